@@ -0,0 +1,375 @@
+# benchmark.py
+"""Retrieval benchmark: quality, latency and memory of every method on the same CVs.
+
+Each method (dense FAISS index types, TF-IDF, BM25, hybrid rerank) is built
+and queried in its own process, so build time and peak RSS are its own. A CV
+is relevant to the postings of its cluster. The report gives recall@k
+(capped at the number of relevant postings), nDCG@k and MRR, per-query
+latency percentiles, batch throughput, build time and index bytes.
+
+    python benchmark.py --postings 1000000 --cvs 500                # synthetic corpus
+    python benchmark.py --corpus subset --methods flat,hnsw,bm25    # data/subset files
+    python benchmark.py --postings 100000 --baseline last_report.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import CONFIG
+from utils import iter_parquet_batches
+
+METHODS = {
+    "flat": {"kind": "dense", "index_type": "flat"},
+    "flat_int8": {"kind": "dense", "index_type": "flat", "quantization": "int8"},
+    "hnsw": {"kind": "dense", "index_type": "hnsw"},
+    "ivf_flat": {"kind": "dense", "index_type": "ivf_flat"},
+    "ivf_pq": {"kind": "dense", "index_type": "ivf_pq"},
+    "tfidf": {"kind": "tfidf"},
+    "tfidf_hashing": {"kind": "tfidf", "vectorizer": "hashing"},
+    "bm25": {"kind": "bm25"},
+    "hybrid": {"kind": "hybrid", "index_type": "flat"},
+}
+DEFAULT_METHODS = ["flat", "hnsw", "ivf_pq", "tfidf", "bm25", "hybrid"]
+
+
+# --- Synthetic corpus -------------------------------------------------------
+
+def _synthetic_texts(rng, clusters, mean_len, topic_share, vocab_size, topic_words, zipf_cdf):
+    """Texts mixing Zipf-distributed background words with words specific to each cluster."""
+    lengths = np.maximum(5, rng.poisson(mean_len, len(clusters)))
+    owner = np.repeat(np.arange(len(clusters)), lengths)
+    n_tokens = len(owner)
+    background = np.searchsorted(zipf_cdf, rng.random(n_tokens))
+    topic = vocab_size + clusters[owner] * topic_words + rng.integers(0, topic_words, n_tokens)
+    tokens = np.where(rng.random(n_tokens) < topic_share, topic, background)
+    words = np.char.add("w", tokens.astype(str))
+    return [" ".join(chunk) for chunk in np.split(words, np.cumsum(lengths)[:-1])]
+
+
+def generate_synthetic_corpus(directory, n_postings, n_cvs, n_clusters=50, vocab_size=30000, topic_words=200, seed=0):
+    """Write ``jobs.parquet`` and ``cvs.parquet`` to ``directory``, streamed in chunks.
+
+    Columns follow the real files: ``job_id``, ``cluster_label``, ``description``
+    for postings, ``cluster_id``, ``cv_standard`` for CVs.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    zipf = 1 / np.arange(1, vocab_size + 1) ** 1.05
+    zipf_cdf = np.cumsum(zipf / zipf.sum())
+
+    writer = None
+    for start in range(0, n_postings, 50000):
+        n = min(50000, n_postings - start)
+        clusters = rng.integers(0, n_clusters, n)
+        table = pa.table({
+            "job_id": np.arange(start, start + n, dtype="int64"),
+            "cluster_label": clusters,
+            "description": _synthetic_texts(rng, clusters, 120, 0.3, vocab_size, topic_words, zipf_cdf),
+        })
+        if writer is None:
+            writer = pq.ParquetWriter(directory / "jobs.parquet", table.schema)
+        writer.write_table(table)
+    writer.close()
+
+    clusters = rng.integers(0, n_clusters, n_cvs)
+    cv_texts = _synthetic_texts(rng, clusters, 150, 0.4, vocab_size, topic_words, zipf_cdf)
+    pd.DataFrame({"cluster_id": clusters, "cv_standard": cv_texts}).to_parquet(directory / "cvs.parquet", index=False)
+
+
+# --- Shared inputs ----------------------------------------------------------
+
+def _prepare_inputs(workdir, jobs_path, cvs_path):
+    """Embed the corpus and CVs once with the configured provider; reused while unchanged."""
+    from embedding_provider import make_embedding_provider
+
+    provider = make_embedding_provider()
+    meta = {"provider": provider.name}
+    # The CV vectors are cached alongside the corpus ones, so either file changing invalidates both.
+    for name, path in (("jobs", jobs_path), ("cvs", cvs_path)):
+        stat = os.stat(path)
+        meta[name] = {"path": str(Path(path).resolve()), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    meta_path = workdir / "vectors.json"
+    if meta_path.exists() and json.loads(meta_path.read_text()) == meta:
+        return
+
+    clusters, vectors = [], None
+    n_rows = pq.ParquetFile(jobs_path).metadata.num_rows
+    row = 0
+    for batch in iter_parquet_batches(jobs_path, ["cluster_label", "description"], batch_rows=CONFIG["ingest_batch_rows"]):
+        texts = [t or "" for t in batch.column("description").to_pylist()]
+        embedded = provider.embed_bulk(texts)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(workdir / "doc_vectors.npy", mode="w+", dtype="float32", shape=(n_rows, embedded.shape[1]))
+        vectors[row:row + len(texts)] = embedded
+        row += len(texts)
+        clusters.append(batch.column("cluster_label").to_numpy())
+    vectors.flush()
+    del vectors
+    np.save(workdir / "doc_clusters.npy", np.concatenate(clusters))
+
+    df_cvs = pd.read_parquet(cvs_path)
+    np.save(workdir / "cv_vectors.npy", provider.embed(df_cvs["cv_standard"].fillna("").tolist()))
+    np.save(workdir / "cv_clusters.npy", df_cvs["cluster_id"].to_numpy())
+    meta_path.write_text(json.dumps(meta))
+
+
+# --- Metrics ----------------------------------------------------------------
+
+def quality_metrics(retrieved, cv_clusters, doc_clusters, ks):
+    """recall@k, nDCG@k (binary gains) and MRR for a ``(n_cvs, max_k)`` matrix of retrieved rows."""
+    n_relevant = pd.Series(doc_clusters).value_counts().reindex(cv_clusters, fill_value=0).to_numpy()
+    hit_clusters = np.where(retrieved >= 0, doc_clusters[np.maximum(retrieved, 0)], -1)
+    relevant = hit_clusters == np.asarray(cv_clusters)[:, None]
+    discounts = 1 / np.log2(np.arange(2, retrieved.shape[1] + 2))
+
+    metrics = {}
+    for k in ks:
+        ideal = np.minimum(k, n_relevant)
+        recall = relevant[:, :k].sum(axis=1) / np.maximum(ideal, 1)
+        dcg = (relevant[:, :k] * discounts[:k]).sum(axis=1)
+        idcg = np.array([discounts[:i].sum() for i in ideal])
+        metrics[f"recall@{k}"] = float(recall.mean())
+        metrics[f"ndcg@{k}"] = float(np.mean(np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1), 0.0)))
+    first = np.where(relevant.any(axis=1), relevant.argmax(axis=1) + 1, np.inf)
+    metrics["mrr"] = float(np.mean(1 / first))
+    return metrics
+
+
+def _peak_rss_bytes():
+    # ru_maxrss survives exec on Linux, so a spawned child would report its
+    # parent's peak; VmHWM belongs to the child's own address space.
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other systems kilobytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _dir_bytes(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+# --- Methods ----------------------------------------------------------------
+
+def _build_method(name, spec, workdir, jobs_path):
+    """Build one method; returns ``(search_fn(cv_texts, cv_vectors, k) -> rows, index_bytes)``."""
+    method_dir = workdir / name
+    if spec["kind"] in ("dense", "hybrid"):
+        from job_index import JobIndex
+        from metadata_store import MetadataStore
+
+        doc_vectors = np.load(workdir / "doc_vectors.npy", mmap_mode="r")
+        store = MetadataStore(method_dir / "jobs.db")
+        job_index = JobIndex.create(
+            doc_vectors.shape[1], store, spec["index_type"], spec.get("quantization"),
+            spec.get("index_dims"), full_vectors_dir=str(method_dir / "full_vectors"),
+        )
+        for start in range(0, len(doc_vectors), 100000):
+            rows = np.arange(start, min(start + 100000, len(doc_vectors)))
+            job_index.add(rows, np.asarray(doc_vectors[rows[0]:rows[-1] + 1]), pd.DataFrame({"job_id": rows}))
+        job_index.save(str(method_dir / "index.faiss"))
+        index_bytes = os.path.getsize(method_dir / "index.faiss")
+
+        if spec["kind"] == "dense":
+            return (lambda texts, vecs, k: job_index.search(vecs, k)[1]), index_bytes
+
+        from lexical import LexicalModel, fuse_scores
+
+        texts = pd.read_parquet(jobs_path, columns=["description"])["description"].fillna("").tolist()
+        lexical = LexicalModel.fit(np.arange(len(texts)), texts)
+        del texts
+
+        def hybrid_search(texts, vecs, k):
+            distances, ids = job_index.search(vecs, max(k, CONFIG["rerank_candidates"]))
+            fused = fuse_scores(distances, lexical.score(texts, ids), CONFIG["rerank_weight"], CONFIG["rerank_method"], CONFIG["rrf_k"])
+            order = np.argsort(-np.where(ids >= 0, fused, -np.inf), axis=1, kind="stable")[:, :k]
+            return np.take_along_axis(ids, order, axis=1)
+
+        lexical_bytes = lexical.matrix.data.nbytes + lexical.matrix.indices.nbytes + lexical.matrix.indptr.nbytes
+        return hybrid_search, index_bytes + lexical_bytes
+
+    if spec["kind"] == "tfidf":
+        from lexical import LexicalModel
+        from evaluate_retrieval_bow import top_k_sparse
+
+        if spec.get("vectorizer") == "hashing":
+            batches = (
+                (batch.column("job_id").to_numpy(), [t or "" for t in batch.column("description").to_pylist()])
+                for batch in iter_parquet_batches(jobs_path, ["job_id", "description"], batch_rows=CONFIG["ingest_batch_rows"])
+            )
+            model = LexicalModel.fit_hashing(batches, method_dir)
+        else:
+            texts = pd.read_parquet(jobs_path, columns=["description"])["description"].fillna("").tolist()
+            model = LexicalModel.fit(np.arange(len(texts)), texts)
+            del texts
+            model.save(method_dir)
+        return (lambda texts, vecs, k: top_k_sparse(model.transform(texts), model.matrix, k)[1]), _dir_bytes(method_dir)
+
+    if spec["kind"] == "bm25":
+        from bm25 import BM25Index
+
+        texts = pd.read_parquet(jobs_path, columns=["description"])["description"].fillna("").tolist()
+        index = BM25Index.fit(np.arange(len(texts)), texts)
+        del texts
+        index.save(method_dir)
+        # search_batch maps rows through ``ids``, which are the row numbers here.
+        return (lambda texts, vecs, k: index.search_batch(texts, k)[1]), _dir_bytes(method_dir)
+
+    raise ValueError(f"Unknown method kind: {spec['kind']}")
+
+
+def run_method(name, spec, workdir, jobs_path, cvs_path, ks, n_latency, config_overrides):
+    """Build and query one method; meant to run in a fresh process."""
+    CONFIG.update(config_overrides)
+    workdir = Path(workdir)
+    cv_texts = pd.read_parquet(cvs_path)["cv_standard"].fillna("").tolist()
+    cv_vectors = np.load(workdir / "cv_vectors.npy")
+    cv_clusters = np.load(workdir / "cv_clusters.npy")
+    doc_clusters = np.load(workdir / "doc_clusters.npy")
+    max_k = max(ks)
+
+    start = time.perf_counter()
+    search, index_bytes = _build_method(name, spec, workdir, jobs_path)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrieved = search(cv_texts, cv_vectors, max_k)
+    batch_s = time.perf_counter() - start
+
+    latencies = []
+    for i in range(min(n_latency, len(cv_texts))):
+        start = time.perf_counter()
+        search(cv_texts[i:i + 1], cv_vectors[i:i + 1], max_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,) * 3
+
+    return {
+        "method": name,
+        **spec,
+        "build_s": build_s,
+        "index_bytes": index_bytes,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "latency_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+        "batch_qps": len(cv_texts) / batch_s if batch_s > 0 else None,
+        "metrics": quality_metrics(np.asarray(retrieved), cv_clusters, doc_clusters, ks),
+    }
+
+
+def run_benchmark(methods, workdir, jobs_path, cvs_path, ks=(1, 3, 10), n_latency=200):
+    """Run every method over the same CVs and return the report dict."""
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    _prepare_inputs(workdir, jobs_path, cvs_path)
+
+    # Spawned processes start from a clean heap, so each peak RSS is the method's own.
+    context = multiprocessing.get_context("spawn")
+    overrides = {key: CONFIG[key] for key in CONFIG}
+    results = []
+    for name in methods:
+        print(f"Benchmarking {name}...")
+        with context.Pool(1) as pool:
+            result = pool.apply(run_method, (name, METHODS[name], str(workdir), str(jobs_path), str(cvs_path), list(ks), n_latency, overrides))
+        results.append(result)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus": {"jobs": str(jobs_path), "n_postings": int(len(np.load(workdir / "doc_clusters.npy", mmap_mode="r"))),
+                   "n_cvs": int(len(np.load(workdir / "cv_clusters.npy")))},
+        "embedding_provider": CONFIG["embedding_provider"],
+        "ks": list(ks),
+        "results": results,
+    }
+
+
+def print_report(report):
+    rows = []
+    for r in report["results"]:
+        row = {"method": r["method"], "build_s": round(r["build_s"], 2), "index_mb": round(r["index_bytes"] / 2 ** 20, 1),
+               "rss_mb": round(r["peak_rss_bytes"] / 2 ** 20, 1) if r["peak_rss_bytes"] else None,
+               "p50_ms": round(r["latency_ms"]["p50"], 2), "p99_ms": round(r["latency_ms"]["p99"], 2)}
+        row.update({name: round(value, 3) for name, value in r["metrics"].items()})
+        rows.append(row)
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+def find_regressions(baseline, report, latency_tolerance=0.2, quality_tolerance=0.01):
+    """Methods whose p95 latency grew or whose quality metrics dropped beyond the tolerances."""
+    previous = {r["method"]: r for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = previous.get(r["method"])
+        if old is None:
+            continue
+        if r["latency_ms"]["p95"] > old["latency_ms"]["p95"] * (1 + latency_tolerance):
+            regressions.append(f"{r['method']}: p95 latency {old['latency_ms']['p95']:.2f} -> {r['latency_ms']['p95']:.2f} ms")
+        for metric, value in r["metrics"].items():
+            if metric in old["metrics"] and value < old["metrics"][metric] - quality_tolerance:
+                regressions.append(f"{r['method']}: {metric} {old['metrics'][metric]:.3f} -> {value:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="synthetic", choices=["synthetic", "subset"])
+    parser.add_argument("--postings", type=int, default=100000, help="Synthetic corpus size")
+    parser.add_argument("--cvs", type=int, default=500, help="Synthetic CV count")
+    parser.add_argument("--methods", default=",".join(DEFAULT_METHODS), help=f"Comma-separated, from: {', '.join(METHODS)}")
+    parser.add_argument("--ks", default="1,3,10")
+    parser.add_argument("--latency-queries", type=int, default=200)
+    parser.add_argument("--provider", default="local", choices=["local", "openai"], help="Embedding provider")
+    parser.add_argument("--output", default=None, help="Report path (default: <benchmark_dir>/report.json)")
+    parser.add_argument("--baseline", default=None, help="Earlier report; exit 1 on regressions")
+    args = parser.parse_args()
+
+    CONFIG["embedding_provider"] = args.provider
+    workdir = Path(CONFIG["benchmark_dir"])
+    if args.corpus == "subset":
+        workdir = workdir / "subset"
+        workdir.mkdir(parents=True, exist_ok=True)
+        source, jobs_path = Path("data/subset/selected_job_descriptions.parquet"), workdir / "jobs.parquet"
+        cvs_path = Path("data/subset/selected_cvs.parquet")
+        if not jobs_path.exists() or os.stat(source).st_mtime_ns > os.stat(jobs_path).st_mtime_ns:
+            # Same columns as the synthetic corpus; row numbers stand in for job ids.
+            df = pd.read_parquet(source)
+            pd.DataFrame({"job_id": np.arange(len(df)), "cluster_label": df["cluster_id"], "description": df["description"]}).to_parquet(jobs_path, index=False)
+    else:
+        workdir = workdir / f"synthetic_{args.postings}_{args.cvs}"
+        jobs_path, cvs_path = workdir / "jobs.parquet", workdir / "cvs.parquet"
+        if not jobs_path.exists():
+            print(f"Generating a synthetic corpus of {args.postings} postings and {args.cvs} CVs...")
+            generate_synthetic_corpus(workdir, args.postings, args.cvs)
+
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    report = run_benchmark(methods, workdir, jobs_path, cvs_path, [int(k) for k in args.ks.split(",")], args.latency_queries)
+    output = Path(args.output) if args.output else workdir / "report.json"
+    output.write_text(json.dumps(report, indent=2))
+    print_report(report)
+    print(f"\nSaved {output}")
+
+    if args.baseline:
+        regressions = find_regressions(json.loads(Path(args.baseline).read_text()), report)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
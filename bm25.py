@@ -0,0 +1,236 @@
+# bm25.py
+"""BM25 inverted index over the job descriptions with MaxScore top-k pruning.
+
+Postings are the columns of a CSC document-term matrix: for each term, the
+ids of the documents containing it (sorted) and the precomputed BM25 impact
+``idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))`` of the term in
+each. ``upper_bounds`` holds the largest impact of every term.
+"""
+import json
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from config import CONFIG
+from lexical import corpus_hash, new_generation, publish, read_generation, read_meta, load_csr_arrays
+
+# Bumped when the on-disk layout changes, so older saved indexes are rebuilt.
+BM25_FORMAT = 1
+
+
+def make_count_vectorizer(vocabulary=None):
+    # Same tokenization as the TF-IDF model, but the full vocabulary: rare
+    # terms are exactly the ones BM25 ranks on.
+    return CountVectorizer(stop_words="english", lowercase=True, vocabulary=vocabulary)
+
+
+class BM25Index:
+    kind = "bm25"
+
+    def __init__(self, vectorizer, postings, ids, version=None, corpus_hash=None, k1=1.2, b=0.75):
+        self.vectorizer = vectorizer
+        self.postings = postings  # CSC (n_docs, n_terms) of BM25 impacts
+        self.ids = ids
+        self.version = version
+        self.corpus_hash = corpus_hash
+        self.k1 = k1
+        self.b = b
+        self.upper_bounds = np.zeros(postings.shape[1], dtype="float32")
+        lengths = np.diff(postings.indptr)
+        nonempty = lengths > 0
+        self.upper_bounds[nonempty] = np.maximum.reduceat(postings.data, postings.indptr[:-1][nonempty])
+        self._rows = None
+        self.postings_scored = 0
+        self.postings_total = 0
+
+    @classmethod
+    def fit(cls, ids, texts, version=None, k1=None, b=None):
+        k1 = CONFIG["bm25_k1"] if k1 is None else k1
+        b = CONFIG["bm25_b"] if b is None else b
+        vectorizer = make_count_vectorizer()
+        counts = vectorizer.fit_transform(texts).tocsr().astype("float32")
+        n_docs = counts.shape[0]
+        doc_len = np.asarray(counts.sum(axis=1)).ravel()
+        avgdl = doc_len.mean() if n_docs else 1.0
+        doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        tf = counts.data
+        rows = np.repeat(np.arange(n_docs), np.diff(counts.indptr))
+        norm = k1 * (1 - b + b * doc_len[rows] / (avgdl or 1.0))
+        counts.data = (idf[counts.indices] * tf * (k1 + 1) / (tf + norm)).astype("float32")
+        postings = counts.tocsc()
+        postings.sort_indices()
+        return cls(vectorizer, postings, np.asarray(ids, dtype="int64"), version, corpus_hash(ids, texts), k1, b)
+
+    @classmethod
+    def build(cls, store, directory=None):
+        """Index every description in ``store`` and save it to ``directory``."""
+        df = store.read_columns(["description"]).sort_values("faiss_id")
+        index = cls.fit(df["faiss_id"].to_numpy(dtype="int64"), df["description"].fillna("").tolist(), store.version)
+        index.save(directory or CONFIG["bm25_index_dir"])
+        return index
+
+    def save(self, directory):
+        # A new generation each time: load() memory-maps the postings (see lexical.publish).
+        target, directory = directory, new_generation(directory)
+        with open(directory / "vocabulary.json", "w", encoding="utf-8") as f:
+            json.dump({term: int(col) for term, col in self.vectorizer.vocabulary_.items()}, f)
+        np.save(directory / "ids.npy", self.ids)
+        np.save(directory / "postings_docs.npy", self.postings.indices)
+        np.save(directory / "postings_impacts.npy", self.postings.data)
+        np.save(directory / "postings_ptr.npy", self.postings.indptr)
+        meta = {"format": BM25_FORMAT, "kind": self.kind, "shape": list(self.postings.shape), "k1": self.k1, "b": self.b,
+                "version": self.version, "corpus_hash": self.corpus_hash}
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        publish(target, directory)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        index = read_generation(directory, lambda generation: cls._load_generation(generation, mmap))
+        if index is None:
+            raise FileNotFoundError(f"no saved BM25 index in {directory}")
+        return index
+
+    @classmethod
+    def _load_generation(cls, directory, mmap):
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(directory / "vocabulary.json", "r", encoding="utf-8") as f:
+            vectorizer = make_count_vectorizer(json.load(f))
+        postings = sp.csc_matrix(
+            load_csr_arrays(directory, ("postings_impacts.npy", "postings_docs.npy", "postings_ptr.npy"), mmap),
+            shape=tuple(meta["shape"]),
+            copy=False,
+        )
+        return cls(vectorizer, postings, np.load(directory / "ids.npy"), meta["version"], meta["corpus_hash"], meta["k1"], meta["b"])
+
+    @classmethod
+    def _load_saved(cls, directory):
+        meta = read_meta(directory)
+        if meta is None:
+            return None
+        # Indexes saved in an older layout, by another scorer or with other parameters are rebuilt.
+        if (meta.get("format") != BM25_FORMAT or meta.get("kind") != cls.kind
+                or (meta["k1"], meta["b"]) != (CONFIG["bm25_k1"], CONFIG["bm25_b"])):
+            return None
+        return cls.load(directory)
+
+    @classmethod
+    def load_or_build(cls, store, directory=None):
+        """Load the saved index, rebuilding it if the store changed since it was saved."""
+        directory = Path(directory or CONFIG["bm25_index_dir"])
+        index = cls._load_saved(directory)
+        if index is not None and index.version == store.version:
+            return index
+        return cls.build(store, directory)
+
+    @classmethod
+    def load_or_fit(cls, directory, ids, texts):
+        """Load the index saved in ``directory`` if it was built from exactly ``(ids, texts)``."""
+        directory = Path(directory)
+        index = cls._load_saved(directory)
+        if index is not None and index.corpus_hash == corpus_hash(ids, texts):
+            return index
+        index = cls.fit(ids, texts)
+        index.save(directory)
+        return index
+
+    def _query_terms(self, text):
+        """Term ids of ``text`` and their query frequencies."""
+        row = self.vectorizer.transform([text])
+        return row.indices, row.data.astype("float32")
+
+    def _postings(self, term):
+        lo, hi = self.postings.indptr[term], self.postings.indptr[term + 1]
+        return self.postings.indices[lo:hi], self.postings.data[lo:hi]
+
+    def search(self, text, k):
+        """Exact BM25 top-``k`` for one query: ``(scores, rows)`` sorted by decreasing score.
+
+        Term-at-a-time MaxScore: terms are visited by decreasing upper bound,
+        scoring their whole postings, until the bound on what the unvisited
+        terms could still add falls below the current k-th best score. From
+        then on no unseen document can reach the top k, so the remaining
+        (long, low-idf) lists are only probed for the surviving candidates,
+        which are pruned again after every term.
+        """
+        terms, weights = self._query_terms(text)
+        bounds = self.upper_bounds[terms] * weights
+        order = np.argsort(-bounds, kind="stable")
+        terms, weights, bounds = terms[order], weights[order], bounds[order]
+        # What the terms after each one can still add, summed rather than subtracted
+        # term by term, so rounding never lets it fall below the true bound.
+        rest = np.append(np.cumsum(bounds[::-1], dtype="float64")[::-1][1:], 0.0)
+
+        acc = np.zeros(self.postings.shape[0], dtype="float32")
+        top = np.empty(0, dtype="int64")  # current k best documents
+        theta = 0.0
+        candidates = None  # set once pruning starts
+        for term, weight, remaining in zip(terms, weights, rest):
+            docs, impacts = self._postings(term)
+            self.postings_total += len(docs)
+            if candidates is None:
+                acc[docs] += weight * impacts
+                self.postings_scored += len(docs)
+                # Only this term's documents changed, so the k best are among them and the previous k best.
+                pos = np.minimum(np.searchsorted(docs, top), len(docs) - 1)
+                pool = np.concatenate([top[docs[pos] != top], docs])
+                if len(pool) > k:
+                    pool = pool[np.argpartition(-acc[pool], k - 1)[:k]]
+                top = pool
+                if len(top) == k:
+                    theta = acc[top].min()
+                    if remaining < theta:
+                        candidates = np.flatnonzero(acc + remaining >= theta)
+            elif len(candidates):
+                pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[pos] == candidates
+                acc[candidates[hit]] += weight * impacts[pos[hit]]
+                self.postings_scored += int(hit.sum())
+                if len(candidates) > k:
+                    theta = np.partition(acc[candidates], len(candidates) - k)[len(candidates) - k]
+                    candidates = candidates[acc[candidates] + remaining >= theta]
+
+        if candidates is not None:
+            top = candidates
+        k = min(k, len(top))
+        top = top[np.argpartition(-acc[top], k - 1)[:k]] if k else top
+        top = top[np.argsort(-acc[top], kind="stable")]
+        return acc[top], top
+
+    def search_batch(self, texts, k):
+        """``(scores, ids)`` arrays of shape ``(len(texts), k)``; missing hits have id -1."""
+        scores = np.zeros((len(texts), k), dtype="float32")
+        ids = np.full((len(texts), k), -1, dtype="int64")
+        for i, text in enumerate(texts):
+            top_scores, rows = self.search(text, k)
+            scores[i, : len(rows)] = top_scores
+            ids[i, : len(rows)] = self.ids[rows]
+        return scores, ids
+
+    def pruning_stats(self):
+        """Share of the query terms' postings that were actually scored."""
+        total = self.postings_total
+        return {"postings_scored": self.postings_scored, "postings_total": total,
+                "scored_fraction": self.postings_scored / total if total else 0.0}
+
+    def score(self, query_texts, candidate_ids):
+        """BM25 score of each query against its ``(nq, c)`` candidate ids; unknown ids score 0.
+
+        Same interface as LexicalModel.score, so either can be the lexical
+        stage of the hybrid retriever.
+        """
+        if self._rows is None:
+            self._rows = self.postings.tocsr()
+        candidate_ids = np.asarray(candidate_ids, dtype="int64")
+        nq, c = candidate_ids.shape
+        flat = candidate_ids.ravel()
+        rows = np.clip(np.searchsorted(self.ids, flat), 0, len(self.ids) - 1)
+        known = self.ids[rows] == flat
+
+        queries = self.vectorizer.transform(query_texts).astype("float32")
+        pairs = self._rows[rows].multiply(queries[np.repeat(np.arange(nq), c)])
+        scores = np.asarray(pairs.sum(axis=1)).ravel()
+        return np.where(known, scores, 0.0).reshape(nq, c)
@@ -0,0 +1,191 @@
+# bulk_match.py
+"""Match a parquet file of CVs against the job index and generate an analysis for each.
+
+CVs are read in batches of ``bulk_batch_rows``. Each batch is retrieved in
+one ``retrieve_batch`` call, in a worker thread, while the completions of the
+previous batch are still running. Completions go through a shared
+``AsyncOpenAI`` client, with at most ``llm_max_concurrency`` in flight and a
+``llm_tokens_per_minute`` budget. Once all of a batch's answers are in, the
+batch is written to ``<output_dir>/part-<batch>.parquet``. A restarted run
+skips the batches whose part file exists. Any answers the interrupted run had
+already received come from the response cache.
+
+    python main.py --bulk-match data/subset/selected_cvs.parquet --bulk-output data/bulk
+"""
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+import openai
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import CONFIG
+from utils import iter_parquet_batches
+from retriever import get_retriever
+from generator import generate_response_async, make_async_client
+from response_cache import get_response_cache
+from tracing import span, count
+
+MANIFEST = "_manifest.json"  # underscore prefix: parquet readers skip it when loading the directory
+MAX_BATCHES_IN_FLIGHT = 2
+
+
+class TokenRateLimiter:
+    """Token bucket refilled at ``tokens_per_minute`` and holding at most one minute of budget."""
+
+    def __init__(self, tokens_per_minute):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(tokens_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n):
+        # A request over the whole budget still goes through, on a full bucket.
+        n = min(n, self.capacity)
+        # Waiters queue on the lock, so a large request is not starved by small ones.
+        async with self._lock:
+            self._refill()
+            while self.tokens < n:
+                await asyncio.sleep((n - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= n
+
+    def refund(self, n):
+        """Give back tokens reserved by ``acquire`` but not used."""
+        if n > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + n)
+
+
+def _check_manifest(output_dir, settings):
+    # Part numbers only mean the same CVs if the input and batching are unchanged.
+    settings = json.loads(json.dumps(settings))  # tuples in filters come back as lists
+    path = output_dir / MANIFEST
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved != settings:
+            raise ValueError(f"{output_dir} holds results of a different bulk run ({saved}); use another output directory")
+        return
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=2)
+
+
+def _part_path(output_dir, batch_no):
+    return output_dir / f"part-{batch_no:06d}.parquet"
+
+
+def _iter_cvs(cv_path, text_column, id_column, batch_rows):
+    """``(batch_no, cv_ids, texts)``; CVs without an ``id_column`` are numbered by row."""
+    offset = 0
+    for batch_no, batch in enumerate(iter_parquet_batches(cv_path, [id_column, text_column], batch_rows=batch_rows)):
+        texts = [t or "" for t in batch.column(text_column).to_pylist()]
+        if id_column in batch.schema.names:
+            ids = [str(i) for i in batch.column(id_column).to_pylist()]
+        else:
+            ids = [str(offset + i) for i in range(len(texts))]
+        offset += len(texts)
+        yield batch_no, ids, texts
+
+
+def _retrieve(retriever, texts, k, filters):
+    """``(job_ids, distances, offer texts)`` per CV, with the hits' metadata read here rather than on the event loop."""
+    return [
+        ([str(h.job_id) for h in row], [h.distance for h in row], [h.text for h in row])
+        for row in retriever.retrieve_batch(texts, k, filters)
+    ]
+
+
+async def _generate(client, text, hits, semaphore, limiter):
+    job_ids, _, docs = hits
+    async with semaphore:
+        try:
+            answer = await generate_response_async(client, text, docs, job_ids, limiter)
+            return answer, None
+        except openai.BadRequestError as e:
+            # Rejected for this CV alone (too long, content filter): record it and move on.
+            count("bulk_errors_total", error=type(e).__name__)
+            return None, str(e)
+
+
+async def _finish_batch(output_dir, batch_no, ids, texts, hits, client, semaphore, limiter):
+    results = await asyncio.gather(*(_generate(client, t, h, semaphore, limiter) for t, h in zip(texts, hits)))
+    table = pa.table({
+        "cv_id": pa.array(ids, pa.string()),
+        "job_ids": pa.array([row[0] for row in hits], pa.list_(pa.string())),
+        "distances": pa.array([row[1] for row in hits], pa.list_(pa.float32())),
+        "response": pa.array([r[0] for r in results], pa.string()),
+        "error": pa.array([r[1] for r in results], pa.string()),
+    })
+    # Written under a dot-name then renamed: a part file either is complete or does not exist.
+    path = _part_path(output_dir, batch_no)
+    tmp = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+    count("bulk_cvs_total", len(ids))
+    return len(ids), sum(r[1] is not None for r in results)
+
+
+def _count_written(stats, results):
+    # Counted once the part file exists, so a failed batch is never reported as written.
+    for n_cvs, n_errors in results:
+        stats["cvs"] += n_cvs
+        stats["batches_written"] += 1
+        stats["errors"] += n_errors
+
+
+async def match_cvs_async(cv_path, output_dir=None, text_column="cv_standard", id_column="cv_id", k=None,
+                          filters=None, batch_rows=None, max_concurrency=None, tokens_per_minute=None, client=None):
+    """Retrieve offers and generate an answer for every CV of ``cv_path``; returns run statistics."""
+    output_dir = Path(output_dir or CONFIG["bulk_output_dir"])
+    batch_rows = batch_rows or CONFIG["bulk_batch_rows"]
+    max_concurrency = max_concurrency or CONFIG["llm_max_concurrency"]
+    tokens_per_minute = CONFIG["llm_tokens_per_minute"] if tokens_per_minute is None else tokens_per_minute
+    _check_manifest(output_dir, {
+        "cv_path": str(Path(cv_path).resolve()), "text_column": text_column, "id_column": id_column,
+        "batch_rows": batch_rows, "k": k or CONFIG["retrieval_top_k"], "filters": filters,
+    })
+
+    retriever = get_retriever()
+    own_client = client is None
+    client = client or make_async_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+
+    start = time.perf_counter()
+    stats = {"cvs": 0, "batches_written": 0, "batches_skipped": 0, "errors": 0}
+    in_flight = set()
+    for batch_no, ids, texts in _iter_cvs(cv_path, text_column, id_column, batch_rows):
+        if _part_path(output_dir, batch_no).exists():
+            stats["batches_skipped"] += 1
+            continue
+        # Runs in a thread, overlapping the completions of the batches still in flight.
+        with span("bulk.retrieve", cvs=len(texts)):
+            hits = await asyncio.to_thread(_retrieve, retriever, texts, k, filters)
+        in_flight.add(asyncio.create_task(
+            _finish_batch(output_dir, batch_no, ids, texts, hits, client, semaphore, limiter)))
+        if len(in_flight) >= MAX_BATCHES_IN_FLIGHT:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            _count_written(stats, [task.result() for task in done])
+    _count_written(stats, await asyncio.gather(*in_flight))
+    if own_client:
+        await client.close()
+
+    elapsed = time.perf_counter() - start
+    cache = get_response_cache()
+    stats.update(elapsed_s=elapsed, cvs_per_s=stats["cvs"] / elapsed if elapsed else 0.0,
+                 response_cache=cache.stats() if cache is not None else None)
+    return stats
+
+
+def match_cvs(cv_path, output_dir=None, **kwargs):
+    """Synchronous entry point for ``match_cvs_async``."""
+    return asyncio.run(match_cvs_async(cv_path, output_dir, **kwargs))
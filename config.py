@@ -2,24 +2,116 @@
 
 CONFIG = {
     # Models
+    "embedding_provider": "openai",  # "openai" or "local" (offline hashed-feature model)
     "embedding_model": "text-embedding-3-large",
     "llm_model": "gpt-4o-mini",
 
     # Embedding parameters
-    "embedding_batch_size": 32,
+    "embedding_batch_size": 2048,  # max inputs per request
+    "embedding_batch_tokens": 50000,  # estimated token budget per request
+    "embedding_max_concurrency": 8,
+    "embedding_max_retries": 6,
+    "embedding_base_url": None,  # e.g. a local fake_embeddings_server.py
+    "embedding_cache_dir": "data/embedding_cache",
+    "embedding_checkpoint_dir": "data/embedding_checkpoints",
+    "local_embedding_dim": 384,
+    "local_embedding_model_path": None,  # optional .npy projection (n_features x dim) for the local provider
+
+    # Index ("flat", "hnsw", "ivf_flat" or "ivf_pq")
+    "index_type": "flat",
+    "index_train_size": 20000,  # vectors buffered to train IVF indexes
+    "hnsw_m": 32,
+    "hnsw_ef_construction": 200,
+    "hnsw_ef_search": 64,
+    "ivf_nlist": 1024,
+    "ivf_nprobe": 16,
+    "pq_m": 64,  # PQ code size in bytes per vector (with pq_nbits = 8)
+    "pq_nbits": 8,
+    "index_quantization": None,  # None, "fp16" or "int8" scalar quantization
+    "index_mmap": True,  # memory-map the index on load (read-only, shared page cache)
+    "index_dims": None,  # e.g. 256: index a truncated prefix, re-score with full vectors
+    "rescore_candidates": 100,
+    "index_shards": 1,  # >1 splits the index into shard files searched in a process pool
+    "shard_by": "hash",  # "hash" of job_id or "cluster" id
+    "shard_workers": None,  # defaults to one process per shard
 
     # Retrieval
     "retrieval_top_k": 5,
+    "http_pool_size": 20,  # kept-alive connections to the embeddings API
+    "query_cache_size": 10000,  # query embeddings kept in memory (LRU)
+    "query_cache_path": "data/query_cache.db",  # None disables the disk tier
+    "query_cache_max_bytes": 512 * 1024 * 1024,
     "use_rerank": True,
-    "rerank_weight": 0.8,
+    "rerank_weight": 0.8,  # weight of the dense score; the rest goes to the lexical score
+    "rerank_method": "weighted",  # "weighted" score fusion or "rrf" (reciprocal-rank fusion)
+    "rerank_candidates": 50,  # dense candidates re-scored by the lexical model
+    "lexical_scorer": "tfidf",  # lexical stage of the rerank: "tfidf" cosine or "bm25"
+    "rrf_k": 60,
+    "tfidf_max_features": 5000,
+    "lexical_vectorizer": "tfidf",  # "tfidf" (fitted vocabulary) or "hashing" (out-of-core build)
+    "lexical_hashing_features": 2 ** 20,
+    "bm25_k1": 1.2,
+    "bm25_b": 0.75,
+
+    # Retrieval service (python main.py --serve)
+    "server_host": "127.0.0.1",
+    "server_port": 8000,
+    "batch_max_size": 64,  # queries coalesced into one embedding call and search
+    "batch_max_wait_ms": 5,  # how long the first query of a batch waits for others
+
+    # Metadata filters: "category" columns match values, "range" columns take (low, high)
+    "filter_columns": {
+        "country": "category",
+        "remote_type": "category",
+        "job_category": "category",
+        "rics_k50": "category",
+        "salary_min": "range",
+        "salary_max": "range",
+    },
+
+    # Tracing (see tracing.py); main.py --trace turns it on for one run
+    "tracing": False,
+    "trace_path": "data/traces/trace.json",
+    "trace_max_spans": 100000,  # later spans are dropped, metrics still count them
 
     # LLM generation
     "llm_temperature": 0.3,
     "llm_max_tokens": 600,
+    "llm_context_tokens": 2500,  # budget for the retrieved offers in the prompt (see context_packer.py)
+    "response_cache_path": "data/response_cache.db",  # None disables caching generated answers
+    "response_cache_max_bytes": 256 * 1024 * 1024,
+    "response_cache_ttl_s": 7 * 24 * 3600,
+    "llm_max_concurrency": 16,  # in-flight completions in bulk matching
+    "llm_tokens_per_minute": 200000,  # prompt + completion budget, None for no limit
+    "llm_max_retries": 6,
+
+    # Bulk matching (bulk_match.py)
+    "bulk_output_dir": "data/bulk",
+    "bulk_batch_rows": 256,  # CVs retrieved together; also one output part file
+
+    # Ingest
+    "selected_clusters": [
+        86, 265, 46, 179, 146, 127, 230, 120, 10, 92,
+        150, 281, 34, 287, 224, 79, 47, 6, 234, 247,
+        126, 241, 285, 103, 77, 276, 279, 111, 62, 205
+    ],
+    "ingest_batch_rows": 4096,
+    "job_metadata_columns": [
+        "job_id", "title_translated", "company", "country", "remote_type",
+        "salary_min", "salary_max", "job_category", "rics_k50"
+    ],
 
     # Paths
+    "clusters_path": "data/cluster_reps_checkpoint_final_20251106_163826.parquet",
+    "jobs_path": "data/sampled_engineers_with_clusters_20251105_175242.parquet",
     "job_offers_dir": "data/job_offers",
     "faiss_index_path": "data/embeddings.faiss",
+    "full_vectors_dir": "data/full_vectors",
     "sqlite_path": "data/sqlite",
+    "filter_index_path": "data/sqlite/filters.npz",
+    "lexical_model_dir": "data/lexical",
+    "bm25_index_dir": "data/bm25",
+    "bow_model_dir": "data/bow",  # BoW evaluation models, one per corpus
+    "benchmark_dir": "data/benchmark",  # synthetic corpora, shared vectors and reports of benchmark.py
     "openai_key_path": "secrets/openai_key.txt"
 }
@@ -0,0 +1,120 @@
+# context_packer.py
+"""Fit the retrieved job descriptions into a prompt token budget.
+
+Each description is split into passages (paragraphs, or sentences when a
+paragraph is too long). Passages repeated across offers, such as
+equal-opportunity statements or benefits blurbs copied from an ATS template,
+are kept only where they first appear. What is left of each offer is ranked by its term
+overlap with the query (the CV) and kept best-first, in reading order, until
+the offer's share of the budget is used up. The ``[Job <id>] <title>`` header
+line the retriever puts on each offer is always kept, so the model can still
+tell the offers apart and cite them.
+"""
+import math
+import re
+from collections import Counter
+from utils import estimate_tokens
+
+_WORD = re.compile(r"\w+")
+_PARAGRAPH = re.compile(r"\n\s*\n|\n(?=\s*[-*•])")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_HEADER = re.compile(r"\[Job [^\]\n]*\][^\n]*")
+ELLIPSIS = " ..."
+MAX_PASSAGE_TOKENS = 120
+
+
+def _terms(text):
+    return [t for t in _WORD.findall(text.lower()) if len(t) > 2]
+
+
+def _normalize(passage):
+    return " ".join(_WORD.findall(passage.lower()))
+
+
+def _unique(passages, seen):
+    kept = []
+    for p in passages:
+        key = _normalize(p)
+        if key not in seen:
+            seen.add(key)
+            kept.append(p)
+    return kept
+
+
+def split_passages(text):
+    """Paragraphs of ``text``, with paragraphs over ``MAX_PASSAGE_TOKENS`` split into sentences."""
+    passages = []
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= MAX_PASSAGE_TOKENS:
+            passages.append(paragraph)
+        else:
+            passages.extend(s.strip() for s in _SENTENCE.split(paragraph) if s.strip())
+    return passages
+
+
+def split_header(doc):
+    """``(header, body)`` of an offer; ``header`` is None when the text has no ``[Job ...]`` line."""
+    match = _HEADER.match(doc)
+    if match is None:
+        return None, doc
+    return match.group(0), doc[match.end():]
+
+
+def _truncate(text, max_tokens):
+    # estimate_tokens counts ~4 characters per token; cut on a word boundary,
+    # leaving room for the ellipsis within the budget.
+    if len(text) <= max_tokens * 4:
+        return text
+    cut = text[: max(0, max_tokens * 4 - len(ELLIPSIS))].rsplit(" ", 1)[0]
+    # No room for a single word: better nothing than a bare ellipsis.
+    return cut + ELLIPSIS if cut.strip() else ""
+
+
+def pack_context(query, docs, max_tokens, separator="\n\n"):
+    """Join ``docs`` into at most ~``max_tokens`` tokens, keeping the passages most relevant to ``query``.
+
+    Offers keep their retrieval order; budget an offer does not use rolls over
+    to the next ones. Headers are kept whole and paid for first; only the
+    bodies are packed. Returns the packed text.
+    """
+    headers, bodies = zip(*(split_header(doc) for doc in docs)) if docs else ((), ())
+    # Passages repeated across the offers (templates, reposted ads) are kept in the first offer only.
+    seen = set()
+    doc_passages = [_unique(split_passages(body), seen) for body in bodies]
+
+    # idf over the kept passages, so terms every offer shares ("experience", "team") weigh little.
+    passage_terms = [[set(_terms(p)) for p in passages] for passages in doc_passages]
+    df = Counter(t for terms in passage_terms for ts in terms for t in ts)
+    n_passages = sum(len(terms) for terms in passage_terms) or 1
+    query_terms = set(_terms(query))
+
+    def relevance(terms, text):
+        overlap = sum(math.log(1 + n_passages / df[t]) for t in terms & query_terms)
+        return overlap / math.sqrt(estimate_tokens(text))
+
+    packed = []
+    budget = max(0, max_tokens - sum(estimate_tokens(h) for h in headers if h is not None))
+    for i, (header, passages, terms) in enumerate(zip(headers, doc_passages, passage_terms)):
+        share = budget // (len(docs) - i)
+        ranked = sorted(range(len(passages)), key=lambda j: -relevance(terms[j], passages[j]))
+        chosen, used = [], 0
+        for j in ranked:
+            cost = estimate_tokens(passages[j])
+            if used + cost <= share:
+                chosen.append(j)
+                used += cost
+            elif not chosen and share > 0:
+                # The best passage alone is over the share: keep its beginning.
+                passages[j] = _truncate(passages[j], share)
+                if passages[j]:
+                    chosen.append(j)
+                    used = estimate_tokens(passages[j])
+                break
+        budget -= used
+        kept = ([header] if header is not None else []) + [passages[j] for j in sorted(chosen)]
+        if kept:
+            packed.append("\n".join(kept))
+    return separator.join(packed)
@@ -0,0 +1,93 @@
+# disk_cache.py
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class DiskCache:
+    """Bytes cache in a SQLite file, evicting least-recently-used entries past ``max_bytes``.
+
+    With ``ttl_s`` entries also expire that many seconds after being written;
+    expired entries read as misses and are the first to go on eviction.
+    """
+
+    def __init__(self, path, max_bytes, ttl_s=None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_access REAL, expires REAL)"
+            )
+            # Files written before TTL support lack the column; their entries never expire.
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(entries)")}
+            if "expires" not in columns:
+                self.conn.execute("ALTER TABLE entries ADD COLUMN expires REAL")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._total = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self.conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            with self.conn:
+                if row[1] is not None and row[1] <= now:
+                    self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return None
+                self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value, ttl_s=None):
+        """Store ``value``; ``ttl_s`` overrides the cache-wide TTL for this entry."""
+        ttl_s = self.ttl_s if ttl_s is None else ttl_s
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access, expires) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now + ttl_s if ttl_s is not None else None),
+                )
+            self._total += len(value)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def purge_expired(self):
+        """Delete every expired entry; returns how many were removed."""
+        with self._lock:
+            removed = self._purge_expired()
+            self._total = self._stored_bytes()
+            return removed
+
+    def _purge_expired(self):
+        with self.conn:
+            return self.conn.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),)).rowcount
+
+    def _evict(self):
+        self._purge_expired()
+        # Recount first: replaced keys and other processes make the running total drift.
+        total = self._stored_bytes()
+        if total > self.max_bytes:
+            # Free down to 90% so eviction does not run on every insert.
+            target = int(self.max_bytes * 0.9)
+            doomed = []
+            for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+                if total <= target:
+                    break
+                doomed.append((key,))
+                total -= size
+            with self.conn:
+                self.conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self._total = total
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -0,0 +1,152 @@
+# embedding_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from vector_store import MemmapVectorStore
+from disk_cache import DiskCache
+from tracing import count
+
+
+def normalize_text(text):
+    return " ".join(str(text).split())
+
+
+def text_key(model, text):
+    payload = f"{model}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, hash of normalized text)."""
+
+    def __init__(self, directory, model):
+        self.model = model
+        # One store per model: vectors from different models differ in dimension.
+        safe_model = model.replace("/", "_")
+        self.store = MemmapVectorStore(Path(directory) / safe_model)
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, texts, embed_fn):
+        """Return embeddings for ``texts``, calling ``embed_fn`` only on cache misses."""
+        keys, cached, found, miss_texts = self._lookup(texts)
+        if miss_texts:
+            self._store(miss_texts, embed_fn(list(miss_texts.values())))
+        return self._result(keys, cached, found)
+
+    async def embed_async(self, texts, embed_fn):
+        """``embed`` with a coroutine ``embed_fn``."""
+        keys, cached, found, miss_texts = self._lookup(texts)
+        if miss_texts:
+            self._store(miss_texts, await embed_fn(list(miss_texts.values())))
+        return self._result(keys, cached, found)
+
+    def _lookup(self, texts):
+        keys = [text_key(self.model, t) for t in texts]
+        cached, found = self.store.get_many(keys)
+
+        # Deduplicate misses so repeated postings are embedded once.
+        miss_texts = {}
+        for i in np.flatnonzero(~found):
+            miss_texts.setdefault(keys[i], texts[i])
+
+        self.hits += int(found.sum())
+        self.misses += int((~found).sum())
+        count("embedding_cache_hits_total", int(found.sum()), cache="ingest")
+        count("embedding_cache_misses_total", int((~found).sum()), cache="ingest")
+        return keys, cached, found, miss_texts
+
+    def _store(self, miss_texts, vectors):
+        self.store.put_many(list(miss_texts), np.asarray(vectors, dtype="float32"))
+
+    def _result(self, keys, cached, found):
+        if found.all():
+            return cached
+        vectors, _ = self.store.get_many(keys)
+        return vectors
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.store),
+        }
+
+
+class QueryEmbeddingCache:
+    """Query embeddings in a bounded in-process LRU, backed by an optional DiskCache tier."""
+
+    def __init__(self, model, max_entries, disk_path=None, disk_max_bytes=None):
+        self.model = model
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = DiskCache(disk_path, disk_max_bytes) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                count("embedding_cache_hits_total", cache="query_memory")
+                return vector
+        if self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype="float32")
+                with self._lock:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                count("embedding_cache_hits_total", cache="query_disk")
+                return vector
+        return None
+
+    def embed(self, texts, embed_fn):
+        """Return embeddings for ``texts``, calling ``embed_fn`` only for texts seen in neither tier."""
+        keys = [text_key(self.model, t) for t in texts]
+        vectors = [self._lookup(k) for k in keys]
+
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], texts[i])
+        with self._lock:
+            self.misses += sum(v is None for v in vectors)
+        count("embedding_cache_misses_total", len(missing), cache="query")
+
+        if missing:
+            new_vecs = np.asarray(embed_fn(list(missing.values())), dtype="float32")
+            fresh = dict(zip(missing, new_vecs))
+            with self._lock:
+                for key, vector in fresh.items():
+                    self._remember(key, vector)
+            if self.disk is not None:
+                for key, vector in fresh.items():
+                    self.disk.set(key, vector.tobytes())
+            vectors = [fresh[k] if v is None else v for k, v in zip(keys, vectors)]
+
+        return np.vstack(vectors) if vectors else np.empty((0, 0), dtype="float32")
+
+    def stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+            "memory_entries": len(self._lru),
+        }
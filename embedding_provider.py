@@ -0,0 +1,131 @@
+# embedding_provider.py
+"""Embedding backends behind one interface, selected by CONFIG ``embedding_provider``.
+
+``openai`` calls the embeddings API; ``local`` is a deterministic hashed-feature
+model that runs on CPU without network access, for offline benchmarks and
+load tests at full corpus scale.
+"""
+import abc
+import asyncio
+import httpx
+import numpy as np
+from openai import OpenAI, DefaultHttpxClient
+from sklearn.feature_extraction.text import HashingVectorizer
+from config import CONFIG
+from utils import read_secret_key
+from embedding_scheduler import pack_batches, embed_texts, make_scheduler
+from tracing import span, count
+
+
+class EmbeddingProvider(abc.ABC):
+    """Turns texts into float32 vectors; ``name`` keys the embedding caches."""
+
+    name = None
+
+    @abc.abstractmethod
+    def embed(self, texts):
+        """Embed a small batch of texts (queries) synchronously."""
+
+    def embed_bulk(self, texts, checkpoint_dir=None):
+        """Embed a large corpus; backends that can resume use ``checkpoint_dir``."""
+        return self.embed(texts)
+
+    async def embed_bulk_async(self, texts, checkpoint_dir=None):
+        """``embed_bulk`` for callers inside an event loop; runs on a worker thread by default."""
+        return await asyncio.to_thread(self.embed_bulk, texts, checkpoint_dir)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, model, base_url=None, pool_size=20):
+        self.name = model
+        self.model = model
+        self.api_key = read_secret_key(CONFIG["openai_key_path"])
+        # Kept-alive TLS connections are reused across query batches.
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=base_url,
+            http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)),
+        )
+        self._scheduler = None
+        self._scheduler_loop = None
+
+    def embed(self, texts):
+        # Requests are packed by token budget rather than a fixed item count.
+        vectors = []
+        for batch in pack_batches(texts, CONFIG["embedding_batch_tokens"], CONFIG["embedding_batch_size"]):
+            with span("embedding.request", inputs=len(batch)):
+                resp = self.client.embeddings.create(model=self.model, input=[texts[i] for i in batch])
+            if resp.usage is not None:
+                count("embedding_tokens_total", resp.usage.total_tokens, model=self.model)
+            data = sorted(resp.data, key=lambda r: r.index)
+            vectors.extend(r.embedding for r in data)
+        return np.array(vectors, dtype="float32")
+
+    def embed_bulk(self, texts, checkpoint_dir=None):
+        # Concurrent, rate-limit aware scheduler with per-batch checkpoints.
+        return embed_texts(texts, checkpoint_dir=checkpoint_dir, model=self.model)
+
+    async def embed_bulk_async(self, texts, checkpoint_dir=None):
+        # One scheduler per event loop, so every call made in it shares the concurrency limit.
+        loop = asyncio.get_running_loop()
+        if self._scheduler_loop is not loop:
+            self._scheduler = make_scheduler(model=self.model)
+            self._scheduler_loop = loop
+        return await self._scheduler.embed(texts, checkpoint_dir)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Deterministic CPU embeddings from hashed unigram and bigram features.
+
+    Without ``model_path`` the signed feature hashes are the embedding
+    (``dim`` buckets). With it, features are hashed into as many buckets as
+    the ``.npy`` projection matrix has rows and projected to its columns, a
+    memory-mapped linear model applied in batches.
+    """
+
+    def __init__(self, dim=384, model_path=None, batch_size=4096):
+        self.projection = None
+        self.dim = dim
+        n_features = dim
+        name = f"local-hashing-{dim}"
+        if model_path is not None:
+            self.projection = np.load(model_path, mmap_mode="r")
+            n_features, self.dim = self.projection.shape
+            name = f"local-{model_path}"
+        self.name = name
+        self.batch_size = batch_size
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            stop_words="english",
+            alternate_sign=True,
+            norm=None,
+            dtype=np.float32,
+        )
+
+    def embed(self, texts):
+        with span("embedding.local", inputs=len(texts)):
+            return self._embed(texts)
+
+    def _embed(self, texts):
+        out = []
+        for start in range(0, len(texts), self.batch_size):
+            features = self.vectorizer.transform(texts[start:start + self.batch_size])
+            features.data = np.sign(features.data) * np.log1p(np.abs(features.data))  # sublinear term counts
+            vectors = features @ self.projection if self.projection is not None else features.toarray()
+            vectors = np.asarray(vectors, dtype="float32")
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            out.append(vectors / np.where(norms > 0, norms, 1))
+        if not out:
+            return np.empty((0, self.dim), dtype="float32")
+        return np.vstack(out)
+
+
+def make_embedding_provider():
+    """Build the provider named by CONFIG ``embedding_provider``."""
+    provider = CONFIG["embedding_provider"]
+    if provider == "openai":
+        return OpenAIEmbeddingProvider(CONFIG["embedding_model"], CONFIG["embedding_base_url"], CONFIG["http_pool_size"])
+    if provider == "local":
+        return LocalEmbeddingProvider(CONFIG["local_embedding_dim"], CONFIG["local_embedding_model_path"])
+    raise ValueError(f"Unknown embedding_provider: {provider!r}")
@@ -0,0 +1,153 @@
+# embedding_scheduler.py
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from openai import AsyncOpenAI
+from config import CONFIG
+from utils import read_secret_key, estimate_tokens, retry_delay, RETRYABLE_ERRORS
+from tracing import span, count
+
+
+def pack_batches(texts, max_tokens, max_items):
+    """Group consecutive text indices into batches bounded by a token budget and item count."""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        n_tokens = estimate_tokens(text)
+        if current and (current_tokens + n_tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_key(model, batch_texts):
+    h = hashlib.sha256(model.encode("utf-8"))
+    for text in batch_texts:
+        h.update(b"\x00")
+        h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+async def _embed_batch(client, model, batch_texts, semaphore, max_retries):
+    async with semaphore:
+        for attempt in range(max_retries + 1):
+            try:
+                with span("embedding.request", inputs=len(batch_texts), attempt=attempt):
+                    resp = await client.embeddings.create(model=model, input=batch_texts)
+                if resp.usage is not None:
+                    count("embedding_tokens_total", resp.usage.total_tokens, model=model)
+                data = sorted(resp.data, key=lambda r: r.index)
+                return np.array([r.embedding for r in data], dtype="float32")
+            except RETRYABLE_ERRORS as e:
+                count("embedding_retries_total", error=type(e).__name__)
+                if attempt == max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(e, attempt))
+
+
+class EmbeddingScheduler:
+    """Embeds lists of texts through one client, rate-limit aware.
+
+    The semaphore belongs to the scheduler, not to a call, so concurrent
+    ``embed`` calls (e.g. successive ingest batches) share the
+    ``max_concurrency`` in-flight requests. Create it inside the event loop
+    that will use it.
+    """
+
+    def __init__(self, client, model, max_concurrency=8, max_batch_tokens=50000, max_batch_items=2048, max_retries=6):
+        self.client = client
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def embed(self, texts, checkpoint_dir=None):
+        """Embed ``texts``, returning a float32 matrix in input order.
+
+        Completed batches are saved under ``checkpoint_dir`` so an interrupted
+        run only re-embeds the batches that had not finished.
+        """
+        if checkpoint_dir is not None:
+            checkpoint_dir = Path(checkpoint_dir)
+            checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+        batches = pack_batches(texts, self.max_batch_tokens, self.max_batch_items)
+        results = [None] * len(batches)
+
+        async def run(b, indices):
+            batch_texts = [texts[i] for i in indices]
+            path = None
+            if checkpoint_dir is not None:
+                path = checkpoint_dir / f"{_batch_key(self.model, batch_texts)}.npy"
+                if path.exists():
+                    results[b] = np.load(path)
+                    return
+            vectors = await _embed_batch(self.client, self.model, batch_texts, self.semaphore, self.max_retries)
+            if path is not None:
+                tmp = path.with_suffix(".tmp")
+                with open(tmp, "wb") as f:
+                    np.save(f, vectors)
+                os.replace(tmp, path)
+            results[b] = vectors
+
+        await asyncio.gather(*(run(b, indices) for b, indices in enumerate(batches)))
+        if not results:
+            return np.empty((0, 0), dtype="float32")
+        return np.vstack(results)
+
+
+async def embed_texts_async(
+    texts,
+    client,
+    model,
+    max_concurrency=8,
+    max_batch_tokens=50000,
+    max_batch_items=2048,
+    checkpoint_dir=None,
+    max_retries=6,
+):
+    """Embed ``texts`` with bounded in-flight requests; one-off form of ``EmbeddingScheduler.embed``."""
+    scheduler = EmbeddingScheduler(client, model, max_concurrency, max_batch_tokens, max_batch_items, max_retries)
+    return await scheduler.embed(texts, checkpoint_dir)
+
+
+def make_scheduler(client=None, model=None):
+    """EmbeddingScheduler with the CONFIG settings; call it inside the event loop that will use it."""
+    if client is None:
+        key = read_secret_key(CONFIG["openai_key_path"])
+        client = AsyncOpenAI(api_key=key, base_url=CONFIG["embedding_base_url"], max_retries=0)
+    return EmbeddingScheduler(
+        client,
+        model or CONFIG["embedding_model"],
+        max_concurrency=CONFIG["embedding_max_concurrency"],
+        max_batch_tokens=CONFIG["embedding_batch_tokens"],
+        max_batch_items=CONFIG["embedding_batch_size"],
+        max_retries=CONFIG["embedding_max_retries"],
+    )
+
+
+def embed_texts(texts, checkpoint_dir=None, client=None, model=None):
+    """Synchronous entry point using the scheduler settings from CONFIG.
+
+    asyncio.run cannot nest, so when called from a running event loop (the
+    server, bulk matching) the scheduler runs on a worker thread instead;
+    async callers should rather await ``make_scheduler().embed``.
+    """
+
+    async def run():
+        return await make_scheduler(client, model).embed(texts, checkpoint_dir)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run())
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(lambda: asyncio.run(run())).result()
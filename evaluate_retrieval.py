@@ -1,8 +1,9 @@
+import time
 import numpy as np
 import pandas as pd
-from openai import OpenAI
-from utils import read_secret_key, load_faiss_index
 from config import CONFIG
+from retriever import get_retriever
+from tracing import span
 
 
 def compute_retrieval_score(distances, retrieved_clusters, cv_cluster):
@@ -12,31 +13,27 @@ def compute_retrieval_score(distances, retrieved_clusters, cv_cluster):
 
 
 def evaluate_all_clusters():
-    key = read_secret_key(CONFIG["openai_key_path"])
-    client = OpenAI(api_key=key)
+    retriever = get_retriever()
 
     cv_path = "data/subset/selected_cvs.parquet"
-    jobs_path = "data/subset/selected_job_descriptions.parquet"
 
-    df_cvs = pd.read_parquet(cv_path)
-    df_jobs = pd.read_parquet(jobs_path)
-    index = load_faiss_index(CONFIG["faiss_index_path"])
-
-    results = []
+    with span("evaluate.load_cvs"):
+        df_cvs = pd.read_parquet(cv_path)
     k = 3
 
-    for _, row in df_cvs.iterrows():
-        cv_text = row["cv_standard"]
-        cv_cluster = row["cluster_id"]
+    # All CVs are embedded in packed requests and searched as one query matrix.
+    cv_texts = df_cvs["cv_standard"].tolist()
+    query_vecs = retriever.embed(cv_texts)
+    start = time.perf_counter()
+    all_distances, all_ids = retriever.search_vectors(query_vecs, k, query_texts=cv_texts)
+    search_ms = (time.perf_counter() - start) * 1000 / len(df_cvs)
 
-        resp = client.embeddings.create(model=CONFIG["embedding_model"], input=[cv_text])
-        query_vec = np.array(resp.data[0].embedding, dtype="float32").reshape(1, -1)
+    with span("evaluate.hit_clusters"):
+        hit_clusters = retriever.store.get_many(all_ids.ravel(), ["cluster_id"])["cluster_id"].to_numpy().reshape(all_ids.shape)
 
-        distances, indices = index.search(query_vec, k)
-        distances, indices = distances[0], indices[0]
-
-        retrieved = df_jobs.iloc[indices]
-        retrieved_clusters = retrieved["cluster_id"].tolist()
+    results = []
+    for cv_cluster, distances, retrieved_clusters in zip(df_cvs["cluster_id"], all_distances, hit_clusters):
+        retrieved_clusters = retrieved_clusters.tolist()
         score = compute_retrieval_score(distances, retrieved_clusters, cv_cluster)
 
         same_cluster_ratio = sum(1 for c in retrieved_clusters if c == cv_cluster) / k
@@ -44,15 +41,20 @@ def evaluate_all_clusters():
         results.append({
             "cluster_id": cv_cluster,
             "same_cluster_ratio": same_cluster_ratio,
-            "retrieval_score": score
+            "retrieval_score": score,
+            "search_ms": search_ms
         })
 
     df_res = pd.DataFrame(results)
     df_res.to_csv("data/evaluation_results_embed.csv", index=False)
 
-    summary = df_res[["same_cluster_ratio", "retrieval_score"]].describe().round(3)
-    print("\n=== Evaluation Summary ===")
+    summary = df_res[["same_cluster_ratio", "retrieval_score", "search_ms"]].describe().round(3)
+    dims = CONFIG["index_dims"] or "full"
+    rerank = f", {CONFIG['rerank_method']} rerank" if CONFIG["use_rerank"] else ""
+    print(f"\n=== Evaluation Summary ({retriever.embedder.name} embeddings, {CONFIG['index_type']} index, {dims} dims{rerank}) ===")
     print(summary)
+    cache = retriever.query_cache.stats()
+    print(f"Query embedding cache: {cache['memory_hits']} memory hits, {cache['disk_hits']} disk hits, {cache['misses']} misses.")
     print("\nSaved evaluation_results.csv")
 
 
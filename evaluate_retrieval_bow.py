@@ -1,60 +1,98 @@
+import time
+from pathlib import Path
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-
-
-def compute_retrieval_score(similarities, retrieved_clusters, cv_cluster):
-    weights = np.array([1.0 if c == cv_cluster else 0.25 for c in retrieved_clusters])
-    return float(np.mean(similarities * weights))
-
-
-def evaluate_all_clusters_bow():
+from config import CONFIG
+from lexical import LexicalModel
+from bm25 import BM25Index
+from tracing import span
+
+
+def compute_retrieval_scores(similarities, retrieved_clusters, cv_clusters):
+    """Per-CV score for ``(n_cvs, k)`` arrays of similarities and retrieved clusters."""
+    weights = np.where(retrieved_clusters == np.asarray(cv_clusters)[:, None], 1.0, 0.25)
+    return (similarities * weights).mean(axis=1)
+
+
+def top_k_sparse(queries, docs, k, chunk_size=1024):
+    """Top-``k`` dot products of sparse query rows against sparse doc rows.
+
+    Queries are scored ``chunk_size`` at a time, so the dense score block never
+    exceeds ``chunk_size x n_docs``. Returns ``(scores, indices)`` sorted by
+    decreasing score.
+    """
+    k = min(k, docs.shape[0])
+    docs_t = docs.T.tocsr()
+    all_scores, all_indices = [], []
+    for start in range(0, queries.shape[0], chunk_size):
+        sims = (queries[start:start + chunk_size] @ docs_t).toarray()
+        # argpartition finds the k best in linear time; only those k get sorted.
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind="stable")
+        all_indices.append(np.take_along_axis(top, order, axis=1))
+        all_scores.append(np.take_along_axis(top_sims, order, axis=1))
+    if not all_scores:
+        return np.empty((0, k)), np.empty((0, k), dtype="int64")
+    return np.vstack(all_scores), np.vstack(all_indices)
+
+
+def _load_jobs(full_corpus):
+    if not full_corpus:
+        return pd.read_parquet("data/subset/selected_job_descriptions.parquet")
+    df_jobs = pd.read_parquet(CONFIG["jobs_path"], columns=["job_id", "cluster_label", "description"])
+    df_jobs = df_jobs.drop_duplicates("job_id").rename(columns={"cluster_label": "cluster_id"})
+    return df_jobs[["cluster_id", "description"]].reset_index(drop=True)
+
+
+def evaluate_all_clusters_bow(full_corpus=False, scoring="tfidf"):
+    """BoW retrieval of the selected CVs against the subset postings, or all of them with ``full_corpus``.
+
+    ``scoring`` is ``tfidf`` (cosine similarity) or ``bm25`` (pruned inverted
+    index; retrieval scores are then raw BM25 values).
+    """
     cv_path = "data/subset/selected_cvs.parquet"
-    jobs_path = "data/subset/selected_job_descriptions.parquet"
 
-    df_cvs = pd.read_parquet(cv_path)
-    df_jobs = pd.read_parquet(jobs_path)
+    with span("evaluate_bow.load", full_corpus=full_corpus):
+        df_cvs = pd.read_parquet(cv_path)
+        df_jobs = _load_jobs(full_corpus)
 
     print(f"Loaded {len(df_cvs)} CVs and {len(df_jobs)} job descriptions for BoW retrieval.")
 
-    vectorizer = TfidfVectorizer(
-        max_features=5000,
-        stop_words="english",
-        lowercase=True,
-    )
-
+    start = time.perf_counter()
+    # Fitted models are saved per corpus and reused while the descriptions are unchanged.
+    corpus = "full" if full_corpus else "subset"
+    model_dir = Path(CONFIG["bow_model_dir"]) / (corpus if scoring == "tfidf" else f"{corpus}_{scoring}")
+    job_rows = np.arange(len(df_jobs))
     job_texts = df_jobs["description"].fillna("").tolist()
-    job_matrix = vectorizer.fit_transform(job_texts)
+    cv_texts = df_cvs["cv_standard"].fillna("").tolist()
 
-    results = []
     k = 3
-
-    for _, row in df_cvs.iterrows():
-        cv_text = row["cv_standard"]
-        cv_cluster = row["cluster_id"]
-
-        cv_vec = vectorizer.transform([cv_text])
-        sims = cosine_similarity(cv_vec, job_matrix).flatten()
-
-        top_indices = np.argsort(sims)[::-1][:k]
-        top_sims = sims[top_indices]
-        retrieved_clusters = df_jobs.iloc[top_indices]["cluster_id"].tolist()
-
-        score = compute_retrieval_score(top_sims, retrieved_clusters, cv_cluster)
-        same_cluster_ratio = sum(1 for c in retrieved_clusters if c == cv_cluster) / k
-
-        results.append({
-            "cluster_id": cv_cluster,
-            "same_cluster_ratio": same_cluster_ratio,
-            "retrieval_score": score
-        })
-
-    df_res = pd.DataFrame(results)
+    scorer = BM25Index if scoring == "bm25" else LexicalModel
+    with span("evaluate_bow.load_model", scoring=scoring):
+        model = scorer.load_or_fit(model_dir, job_rows, job_texts)
+    with span("evaluate_bow.search", scoring=scoring, queries=len(cv_texts)):
+        if scoring == "bm25":
+            top_sims, top_indices = model.search_batch(cv_texts, k)
+        else:
+            # TF-IDF rows are L2-normalized, so the dot product is the cosine similarity.
+            top_sims, top_indices = top_k_sparse(model.transform(cv_texts), model.matrix, k)
+    # BM25 pads queries with fewer than k matching postings with -1.
+    retrieved_clusters = np.where(top_indices >= 0, df_jobs["cluster_id"].to_numpy()[top_indices], -1)
+    cv_clusters = df_cvs["cluster_id"].to_numpy()
+    elapsed = time.perf_counter() - start
+
+    df_res = pd.DataFrame({
+        "cluster_id": cv_clusters,
+        "same_cluster_ratio": (retrieved_clusters == cv_clusters[:, None]).mean(axis=1),
+        "retrieval_score": compute_retrieval_scores(top_sims, retrieved_clusters, cv_clusters),
+    })
     df_res.to_csv("data/evaluation_results_bow.csv", index=False)
 
     summary = df_res[["same_cluster_ratio", "retrieval_score"]].describe().round(3)
-    print("\n=== BoW Retrieval Summary ===")
+    print(f"\n=== BoW Retrieval Summary ({corpus} corpus, {model.kind}, {elapsed:.2f}s) ===")
     print(summary)
+    if scoring == "bm25":
+        stats = model.pruning_stats()
+        print(f"Postings scored: {stats['postings_scored']} of {stats['postings_total']} ({stats['scored_fraction']:.1%}).")
     print("\nSaved evaluation_results_bow.csv")
-
@@ -0,0 +1,115 @@
+# fake_embeddings_server.py
+"""Local stand-in for the OpenAI embeddings endpoint.
+
+Returns deterministic vectors and can inject latency and 429 responses, so the
+embedding scheduler can be exercised without network access or paid calls:
+
+    python fake_embeddings_server.py --port 8765 --latency 0.2 --rate-limit-prob 0.1
+
+then set ``CONFIG["embedding_base_url"] = "http://127.0.0.1:8765/v1"``.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def fake_embedding(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    return vec / np.linalg.norm(vec)
+
+
+def make_handler(dim, latency, rate_limit_prob):
+    class Handler(BaseHTTPRequestHandler):
+        stats = {"requests": 0, "rate_limited": 0}
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.endswith("/embeddings"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            Handler.stats["requests"] += 1
+
+            if latency:
+                time.sleep(latency)
+            if random.random() < rate_limit_prob:
+                Handler.stats["rate_limited"] += 1
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                    headers={"retry-after": "0.05"},
+                )
+                return
+
+            inputs = request["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            use_base64 = request.get("encoding_format") == "base64"
+
+            data = []
+            for i, text in enumerate(inputs):
+                vec = fake_embedding(text, dim)
+                embedding = base64.b64encode(vec.tobytes()).decode("ascii") if use_base64 else vec.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+            n_tokens = sum(max(1, len(t) // 4) for t in inputs)
+            self._send_json(200, {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "fake"),
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            })
+
+    return Handler
+
+
+def make_server(host="127.0.0.1", port=0, dim=256, latency=0.0, rate_limit_prob=0.0):
+    return ThreadingHTTPServer((host, port), make_handler(dim, latency, rate_limit_prob))
+
+
+def start_in_thread(**kwargs):
+    """Start a server on a background thread and return ``(server, base_url)``."""
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="Probability of answering 429")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.dim, args.latency, args.rate_limit_prob)
+    print(f"Fake embeddings server on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
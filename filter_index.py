@@ -0,0 +1,145 @@
+# filter_index.py
+import numbers
+import re
+from pathlib import Path
+import numpy as np
+from config import CONFIG
+
+FILTER_FORMAT = 2  # 2: categorical values stored as category_key()
+_DECIMAL = re.compile(r"-?\d+\.\d*")
+
+
+def category_key(value):
+    """String form under which a categorical value is indexed and looked up.
+
+    Numbers are written the same however they were typed, so ``1``, ``1.0``
+    and ``"1.0"`` all match a column that pandas read as floats. Other
+    strings, leading zeros included, are kept as they are.
+    """
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    value = str(value)
+    if _DECIMAL.fullmatch(value):
+        value = value.rstrip("0").rstrip(".")
+        return "0" if value == "-0" else value
+    return value
+
+
+def _is_bound(value):
+    return value is None or (isinstance(value, numbers.Real) and not isinstance(value, bool))
+
+
+class FilterIndex:
+    """Precomputed per-column structures that turn metadata predicates into allowed FAISS ids.
+
+    Categorical columns keep, for each value, the sorted ids having it.
+    Range columns keep their values sorted alongside the matching ids, so a
+    bound is a ``searchsorted``. Filters look like::
+
+        {"country": "Canada", "remote_type": ["Remote", "Hybrid"], "salary_min": (90000, None)}
+
+    Lists mean any of the values; ``(low, high)`` tuples are inclusive and
+    either bound may be ``None``. Malformed predicates raise ``ValueError``.
+    """
+
+    def __init__(self, arrays, version, format=FILTER_FORMAT):
+        self.arrays = arrays
+        self.version = version
+        self.format = format
+
+    @classmethod
+    def build(cls, store):
+        spec = CONFIG["filter_columns"]
+        available = set(store.columns())
+        columns = [c for c in spec if c in available]
+        df = store.read_columns(columns)
+        ids = df["faiss_id"].to_numpy(dtype="int64")
+
+        arrays = {}
+        for col in columns:
+            values = df[col]
+            present = values.notna().to_numpy()
+            if spec[col] == "range":
+                numeric = values.to_numpy(dtype="float64")[present]
+                order = np.argsort(numeric, kind="stable")
+                arrays[f"{col}__sorted"] = numeric[order]
+                arrays[f"{col}__ids"] = ids[present][order]
+            else:
+                keys = np.asarray([category_key(v) for v in values[present].tolist()], dtype=str)
+                col_ids = ids[present]
+                order = np.lexsort((col_ids, keys))
+                keys, col_ids = keys[order], col_ids[order]
+                uniques, starts = np.unique(keys, return_index=True)
+                arrays[f"{col}__values"] = uniques
+                arrays[f"{col}__offsets"] = np.append(starts, len(keys))
+                arrays[f"{col}__ids"] = col_ids
+        return cls(arrays, store.version)
+
+    def save(self, path):
+        np.savez(path, version=self.version, format=self.format, **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files if k not in ("version", "format")}
+            return cls(arrays, int(data["version"]), int(data["format"]) if "format" in data.files else 1)
+
+    @classmethod
+    def load_or_build(cls, store, path=None):
+        """Load the saved filter index, rebuilding it if the store changed since it was saved."""
+        path = Path(path or CONFIG["filter_index_path"])
+        if path.exists():
+            filter_index = cls.load(path)
+            if filter_index.version == store.version and filter_index.format == FILTER_FORMAT:
+                return filter_index
+        filter_index = cls.build(store)
+        filter_index.save(path)
+        return filter_index
+
+    def _column_ids(self, col, condition):
+        if f"{col}__sorted" in self.arrays:
+            low, high = condition
+            sorted_values = self.arrays[f"{col}__sorted"]
+            start = 0 if low is None else np.searchsorted(sorted_values, low, side="left")
+            stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side="right")
+            return np.sort(self.arrays[f"{col}__ids"][start:stop])
+
+        if f"{col}__values" not in self.arrays:
+            raise ValueError(f"Column {col!r} is not filterable; see CONFIG['filter_columns']")
+        wanted = [condition] if isinstance(condition, str) or np.isscalar(condition) else condition
+        wanted = [category_key(value) for value in wanted]
+        values = self.arrays[f"{col}__values"]
+        offsets = self.arrays[f"{col}__offsets"]
+        col_ids = self.arrays[f"{col}__ids"]
+        parts = []
+        for value in wanted:
+            pos = np.searchsorted(values, value)
+            if pos < len(values) and values[pos] == value:
+                parts.append(col_ids[offsets[pos] : offsets[pos + 1]])
+        if not parts:
+            return np.empty(0, dtype="int64")
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+    def allowed_ids(self, filters):
+        """Sorted int64 array of the FAISS ids matching every predicate in ``filters``."""
+        allowed = None
+        for col, condition in filters.items():
+            self._check_condition(col, condition)
+            col_ids = self._column_ids(col, condition)
+            allowed = col_ids if allowed is None else np.intersect1d(allowed, col_ids, assume_unique=True)
+            if len(allowed) == 0:
+                break
+        return allowed
+
+    def _check_condition(self, col, condition):
+        if f"{col}__sorted" in self.arrays:
+            if (not isinstance(condition, (list, tuple)) or len(condition) != 2
+                    or not all(_is_bound(bound) for bound in condition)):
+                raise ValueError(f"Filter on range column {col!r} must be a (low, high) pair of numbers or None, "
+                                 f"got {condition!r}")
+        elif f"{col}__values" in self.arrays:
+            wanted = [condition] if isinstance(condition, str) or np.isscalar(condition) else condition
+            if not isinstance(wanted, (list, tuple, set)) or not all(
+                    isinstance(v, str) or np.isscalar(v) for v in wanted):
+                raise ValueError(f"Filter on column {col!r} must be a value or a list of values, got {condition!r}")
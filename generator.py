@@ -1,25 +1,182 @@
 # generator.py
-import os
-from openai import OpenAI
+import asyncio
+import threading
+import time
+from openai import OpenAI, AsyncOpenAI
 from config import CONFIG
-from utils import read_secret_key
+from utils import read_secret_key, estimate_tokens, retry_delay, RETRYABLE_ERRORS
+from context_packer import pack_context
+from response_cache import get_response_cache, docs_key
+from tracing import span, count, observe
 
-def generate_response(cv_text, retrieved_docs):
-    key = read_secret_key(CONFIG["openai_key_path"])
-    client = OpenAI(api_key=key)
 
-    context = "\n\n".join(retrieved_docs)
-    prompt = (
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide OpenAI client, so connections are kept alive across calls."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=read_secret_key(CONFIG["openai_key_path"]))
+        return _client
+
+
+def make_async_client():
+    # Retries are handled by generate_response_async, with the same backoff as embeddings (utils.retry_delay).
+    return AsyncOpenAI(api_key=read_secret_key(CONFIG["openai_key_path"]), max_retries=0)
+
+
+def build_prompt(cv_text, retrieved_docs, max_context_tokens=None):
+    """Prompt with the offers packed into ``max_context_tokens`` (CONFIG ``llm_context_tokens`` by default)."""
+    budget = CONFIG["llm_context_tokens"] if max_context_tokens is None else max_context_tokens
+    with span("generator.pack_context", docs=len(retrieved_docs), budget=budget):
+        context = pack_context(cv_text, retrieved_docs, budget)
+    return (
         f"Profil du candidat :\n{cv_text}\n\n"
         f"Offres d'emploi correspondantes :\n{context}\n\n"
         "Analyse les correspondances les plus pertinentes entre ce profil et les offres."
     )
 
-    resp = client.chat.completions.create(
+
+def _count_usage(usage):
+    if usage is not None:
+        count("llm_tokens_total", usage.prompt_tokens, model=CONFIG["llm_model"], kind="prompt")
+        count("llm_tokens_total", usage.completion_tokens, model=CONFIG["llm_model"], kind="completion")
+
+
+def _cached(cv_text, retrieved_docs, job_ids):
+    """``(cache, key, cached answer)``; the cache is None when disabled."""
+    cache = get_response_cache()
+    if cache is None:
+        return None, None, None
+    cache_key = cache.key(cv_text, docs_key(retrieved_docs) if job_ids is None else job_ids)
+    return cache, cache_key, cache.get(cache_key)
+
+
+def generate_response(cv_text, retrieved_docs, job_ids=None):
+    """LLM analysis of ``cv_text`` against the retrieved offers.
+
+    Answers are cached by CV, ``job_ids`` (the offers' texts when not given)
+    and model parameters.
+    """
+    cache, cache_key, answer = _cached(cv_text, retrieved_docs, job_ids)
+    if answer is not None:
+        return answer
+
+    client = get_client()
+    prompt = build_prompt(cv_text, retrieved_docs)
+
+    with span("generator.llm", model=CONFIG["llm_model"], prompt_chars=len(prompt)):
+        resp = client.chat.completions.create(
+            model=CONFIG["llm_model"],
+            temperature=CONFIG["llm_temperature"],
+            max_tokens=CONFIG["llm_max_tokens"],
+            messages=[{"role": "user", "content": prompt}]
+        )
+    _count_usage(resp.usage)
+
+    answer = resp.choices[0].message.content
+    if cache is not None and answer:
+        cache.set(cache_key, answer)
+    return answer
+
+
+async def generate_response_async(client, cv_text, retrieved_docs, job_ids=None, limiter=None, max_retries=None):
+    """``generate_response`` on an ``AsyncOpenAI`` client, for many CVs at once.
+
+    ``limiter`` (see bulk_match.TokenRateLimiter) is charged the estimated
+    prompt tokens plus ``llm_max_tokens`` before each attempt; the unused part
+    of that reservation is refunded once the real usage is known, and all of
+    it when the attempt fails.
+    """
+    cache, cache_key, answer = _cached(cv_text, retrieved_docs, job_ids)
+    if answer is not None:
+        return answer
+
+    prompt = build_prompt(cv_text, retrieved_docs)
+    max_retries = CONFIG["llm_max_retries"] if max_retries is None else max_retries
+    reserved = estimate_tokens(prompt) + CONFIG["llm_max_tokens"]
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire(reserved)
+        try:
+            with span("generator.llm", model=CONFIG["llm_model"], prompt_chars=len(prompt), attempt=attempt):
+                resp = await client.chat.completions.create(
+                    model=CONFIG["llm_model"],
+                    temperature=CONFIG["llm_temperature"],
+                    max_tokens=CONFIG["llm_max_tokens"],
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            break
+        except RETRYABLE_ERRORS as e:
+            # A failed request is not billed: give its reservation back before waiting to retry.
+            if limiter is not None:
+                limiter.refund(reserved)
+            count("llm_retries_total", error=type(e).__name__)
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt))
+        except BaseException:
+            # Rejected (bad request) or cancelled: same, the tokens were not spent.
+            if limiter is not None:
+                limiter.refund(reserved)
+            raise
+    _count_usage(resp.usage)
+    if limiter is not None and resp.usage is not None:
+        limiter.refund(reserved - resp.usage.total_tokens)
+
+    answer = resp.choices[0].message.content
+    if cache is not None and answer:
+        cache.set(cache_key, answer)
+    return answer
+
+
+def stream_response(cv_text, retrieved_docs, stats=None, job_ids=None):
+    """Same answer as ``generate_response``, yielded as text chunks while they arrive.
+
+    If a ``stats`` dict is given it is filled with ``time_to_first_token_s``
+    and ``total_s`` (both from the request start) once the stream ends.
+    A cached answer is yielded whole, as a single chunk.
+    """
+    start = time.perf_counter()
+    cache, cache_key, answer = _cached(cv_text, retrieved_docs, job_ids)
+    if answer is not None:
+        yield answer
+        if stats is not None:
+            stats["time_to_first_token_s"] = stats["total_s"] = time.perf_counter() - start
+        return
+
+    client = get_client()
+    prompt = build_prompt(cv_text, retrieved_docs)
+
+    # Timed by hand: a span must not stay open across the yields.
+    first_token = None
+    chunks = []
+    stream = client.chat.completions.create(
         model=CONFIG["llm_model"],
         temperature=CONFIG["llm_temperature"],
         max_tokens=CONFIG["llm_max_tokens"],
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        stream_options={"include_usage": True},
     )
-
-    return resp.choices[0].message.content
+    for chunk in stream:
+        # The final chunk carries the usage and no choices.
+        _count_usage(chunk.usage)
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+            observe("llm_time_to_first_token_seconds", first_token, model=CONFIG["llm_model"])
+        chunks.append(chunk.choices[0].delta.content)
+        yield chunks[-1]
+    # Reached only when the stream ran to the end; an empty answer is not worth keeping.
+    if cache is not None and chunks:
+        cache.set(cache_key, "".join(chunks))
+    total = time.perf_counter() - start
+    observe("llm_stream_seconds", total, model=CONFIG["llm_model"])
+    if stats is not None:
+        stats["time_to_first_token_s"] = first_token
+        stats["total_s"] = total
@@ -1,58 +1,174 @@
+import asyncio
+import shutil
+from collections import deque
 import pandas as pd
 import numpy as np
-import faiss
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
-from openai import OpenAI
 from config import CONFIG
-from utils import read_secret_key, save_faiss_index
+from utils import iter_parquet_batches
+from embedding_cache import EmbeddingCache
+from embedding_provider import make_embedding_provider
+from job_index import create_job_index, load_job_index, job_faiss_ids
+from metadata_store import open_metadata_store
+from filter_index import FilterIndex
+from lexical import LexicalModel
+from bm25 import BM25Index
+from tracing import span, count
 
+EMBED_AHEAD = 2  # batches embedding while the current one is indexed
 
-def build_embeddings():
-    clusters_path = Path("data/cluster_reps_checkpoint_final_20251106_163826.parquet")
-    jobs_path = Path("data/sampled_engineers_with_clusters_20251105_175242.parquet")
 
-    df_clusters = pd.read_parquet(clusters_path)
-    df_jobs = pd.read_parquet(jobs_path)
+def iter_job_batches(path, selected_clusters=None):
+    """Yield job postings as Arrow tables, one row-group batch at a time."""
+    columns = ["cluster_label", "description"] + CONFIG["job_metadata_columns"]
+    predicate = None
+    if selected_clusters is not None:
+        predicate = ds.field("cluster_label").isin(selected_clusters)
+    for batch in iter_parquet_batches(path, columns, predicate, CONFIG["ingest_batch_rows"]):
+        table = pa.Table.from_batches([batch])
+        yield table.rename_columns(["cluster_id" if c == "cluster_label" else c for c in table.column_names])
+
 
-    selected_clusters = [
-        86, 265, 46, 179, 146, 127, 230, 120, 10, 92,
-        150, 281, 34, 287, 224, 79, 47, 6, 234, 247,
-        126, 241, 285, 103, 77, 276, 279, 111, 62, 205
-    ]
+def build_embeddings():
+    selected_clusters = CONFIG["selected_clusters"]
     print(f"Selected clusters: {selected_clusters}")
 
-    cv_subset = df_clusters[df_clusters["cluster_id"].isin(selected_clusters)][
-        ["cluster_id", "cv_standard"]
-    ]
-    jobs_subset = df_jobs[df_jobs["cluster_label"].isin(selected_clusters)][
-        ["cluster_label", "description"]
-    ].rename(columns={"cluster_label": "cluster_id"})
+    with span("ingest.load_cvs"):
+        cv_subset = pd.read_parquet(
+            CONFIG["clusters_path"],
+            columns=["cluster_id", "cv_standard"],
+            filters=[("cluster_id", "in", selected_clusters)],
+        )
 
     output_dir = Path("data/subset")
     output_dir.mkdir(exist_ok=True)
 
     cv_subset.to_parquet(output_dir / "selected_cvs.parquet", index=False)
-    jobs_subset.to_parquet(output_dir / "selected_job_descriptions.parquet", index=False)
-
     print(f"{len(cv_subset)} CVs saved.")
-    print(f"{len(jobs_subset)} job descriptions saved.")
 
-    key = read_secret_key(CONFIG["openai_key_path"])
-    client = OpenAI(api_key=key)
+    asyncio.run(_build_index(output_dir, selected_clusters))
+
+
+async def _build_index(output_dir, selected_clusters):
+    provider = make_embedding_provider()
+    cache = EmbeddingCache(CONFIG["embedding_cache_dir"], provider.name)
+    store = open_metadata_store()
+    job_index = None
+    jobs_writer = None
+    n_jobs = 0
+
+    frames = (table.to_pandas().drop_duplicates("job_id") for table in iter_job_batches(CONFIG["jobs_path"], selected_clusters))
+    async for df, embeddings in _embed_ahead(cache, provider, frames):
+        if job_index is not None:
+            # Postings repeated across batches keep their first occurrence.
+            seen = store.existing(job_faiss_ids(df["job_id"]))
+            keep = ~np.isin(job_faiss_ids(df["job_id"]), list(seen))
+            df, embeddings = df[keep], embeddings[keep]
+        if df.empty:
+            continue
+
+        if job_index is None:
+            job_index = create_job_index(embeddings.shape[1], store)
+            jobs_writer = pq.ParquetWriter(output_dir / "selected_job_descriptions.parquet", pa.Table.from_pandas(df[["cluster_id", "description"]], preserve_index=False).schema)
+        with span("ingest.index_add", rows=len(df)):
+            job_index.add(df["job_id"].tolist(), embeddings, df)
+        jobs_writer.write_table(pa.Table.from_pandas(df[["cluster_id", "description"]], schema=jobs_writer.schema, preserve_index=False))
+        n_jobs += len(df)
+        count("ingest_postings_total", len(df))
+
+    if job_index is None:
+        print("No job descriptions found for the selected clusters.")
+        return
+
+    jobs_writer.close()
+    print(f"{n_jobs} job descriptions saved.")
+    _report_cache(cache)
+
+    _save_derived(job_index, store)
+    print(f"Indexed {n_jobs} job descriptions into FAISS.")
+
+
+def apply_job_delta(new_jobs_path=None, expired_job_ids=()):
+    """Apply a delta of new/changed postings and expired job_ids to the existing index.
+
+    ``new_jobs_path`` is a parquet file with the same columns as the postings
+    file; postings whose job_id is already indexed are updated in place.
+    """
+    asyncio.run(_apply_job_delta(new_jobs_path, expired_job_ids))
+
+
+async def _apply_job_delta(new_jobs_path, expired_job_ids):
+    provider = make_embedding_provider()
+    cache = EmbeddingCache(CONFIG["embedding_cache_dir"], provider.name)
+    store = open_metadata_store()
+    # The delta modifies the index, so it needs a private, writable copy.
+    job_index = load_job_index(store, mmap=False)
+
+    if len(expired_job_ids):
+        removed = job_index.remove(list(expired_job_ids))
+        print(f"Removed {removed} expired postings.")
+
+    n_added, n_updated = 0, 0
+    if new_jobs_path is not None:
+        frames = (table.to_pandas().drop_duplicates("job_id", keep="last") for table in iter_job_batches(new_jobs_path))
+        async for df, embeddings in _embed_ahead(cache, provider, frames):
+            existing = np.isin(job_faiss_ids(df["job_id"]), list(store.existing(job_faiss_ids(df["job_id"]))))
+            if existing.any():
+                job_index.update(df["job_id"][existing].tolist(), embeddings[existing], df[existing])
+            if (~existing).any():
+                job_index.add(df["job_id"][~existing].tolist(), embeddings[~existing], df[~existing])
+            n_updated += int(existing.sum())
+            n_added += int((~existing).sum())
+        _report_cache(cache)
+
+    _save_derived(job_index, store)
+    print(f"Added {n_added} and updated {n_updated} postings; index now holds {len(job_index)}.")
+
+
+async def _embed_ahead(cache, provider, frames):
+    """``(df, embeddings)`` for each frame, in order, with up to ``EMBED_AHEAD`` frames embedding meanwhile.
+
+    All the embedding calls run in this one event loop, so the provider's
+    scheduler keeps its requests in flight across batch boundaries while the
+    caller indexes the current batch.
+    """
+    pending = deque()
+    for df in frames:
+        pending.append((df, asyncio.create_task(_embed_descriptions(cache, provider, df))))
+        if len(pending) > EMBED_AHEAD:
+            df, task = pending.popleft()
+            yield df, await task
+    while pending:
+        df, task = pending.popleft()
+        yield df, await task
+
+
+async def _embed_descriptions(cache, provider, df):
+    def embed_misses(batch_texts):
+        return provider.embed_bulk_async(batch_texts, checkpoint_dir=CONFIG["embedding_checkpoint_dir"])
+
+    texts = df["description"].fillna("").tolist()
+    with span("ingest.embed", rows=len(texts)):
+        return await cache.embed_async(texts, embed_misses)
 
-    texts = jobs_subset["description"].fillna("").tolist()
-    vectors = []
 
-    for i in range(0, len(texts), CONFIG["embedding_batch_size"]):
-        batch = texts[i : i + CONFIG["embedding_batch_size"]]
-        resp = client.embeddings.create(model=CONFIG["embedding_model"], input=batch)
-        batch_vecs = [r.embedding for r in resp.data]
-        vectors.extend(batch_vecs)
+def _save_derived(job_index, store):
+    with span("ingest.save_index"):
+        job_index.save(CONFIG["faiss_index_path"])
+    with span("ingest.build_filters"):
+        FilterIndex.build(store).save(CONFIG["filter_index_path"])
+    with span("ingest.build_lexical", scorer=CONFIG["lexical_scorer"]):
+        if CONFIG["lexical_scorer"] == "bm25":
+            BM25Index.build(store)
+        else:
+            LexicalModel.build(store)
 
-    embeddings = np.array(vectors).astype("float32")
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
-    save_faiss_index(index, CONFIG["faiss_index_path"])
 
-    jobs_subset.to_parquet("data/sqlite/job_offers.parquet", index=False)
-    print(f"Indexed {len(texts)} job descriptions into FAISS.")
+def _report_cache(cache):
+    # Every vector is now in the cache, so the per-batch checkpoints are spent.
+    shutil.rmtree(CONFIG["embedding_checkpoint_dir"], ignore_errors=True)
+    stats = cache.stats()
+    print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate).")
@@ -0,0 +1,458 @@
+# job_index.py
+import hashlib
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import faiss
+from config import CONFIG
+from utils import save_faiss_index, load_faiss_index
+from vector_store import MemmapVectorStore
+
+INT63_MAX = 2 ** 63 - 1
+
+
+def job_faiss_id(job_id):
+    """Map a job_id to the int64 id stored in FAISS: numeric ids are kept, others are hashed."""
+    text = str(job_id)
+    if text.isdigit() and int(text) <= INT63_MAX:
+        return int(text)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & INT63_MAX
+
+
+def job_faiss_ids(job_ids):
+    return np.array([job_faiss_id(j) for j in np.atleast_1d(job_ids)], dtype="int64")
+
+
+SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def truncate_embeddings(vectors, dims):
+    """Keep the first ``dims`` components and renormalize (text-embedding-3 vectors allow this)."""
+    prefix = np.ascontiguousarray(vectors[:, :dims], dtype="float32")
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.maximum(norms, 1e-12)
+
+
+def make_base_index(dim, index_type, n_train=None, quantization=None):
+    """Build the un-trained FAISS index selected by ``index_type`` from CONFIG parameters.
+
+    ``quantization`` ("fp16" or "int8") stores flat, HNSW and IVF-Flat vectors
+    with a scalar quantizer; IVF-PQ is already compressed and ignores it.
+    """
+    qtype = SQ_TYPES[quantization] if quantization else None
+    if index_type == "flat":
+        if qtype is not None:
+            return faiss.IndexScalarQuantizer(dim, qtype)
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, CONFIG["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWFlat(dim, CONFIG["hnsw_m"])
+        index.hnsw.efConstruction = CONFIG["hnsw_ef_construction"]
+        return index
+
+    # Each IVF centroid wants ~39 training points; small corpora get fewer lists.
+    nlist = CONFIG["ivf_nlist"]
+    if n_train is not None:
+        nlist = max(1, min(nlist, n_train // 39))
+    if index_type == "ivf_flat":
+        if qtype is not None:
+            return faiss.IndexIVFScalarQuantizer(faiss.IndexFlatL2(dim), dim, nlist, qtype)
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+    if index_type == "ivf_pq":
+        pq_m = CONFIG["pq_m"]
+        if dim % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+        # Each of the 2**nbits PQ centroids also wants ~39 training points.
+        nbits = CONFIG["pq_nbits"]
+        if n_train is not None:
+            nbits = min(nbits, int(np.log2(max(1, n_train // 39))))
+            if nbits < 1:
+                # Too few vectors to train any codebook: store them uncompressed.
+                return faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+        return faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, pq_m, nbits)
+    raise ValueError(f"Unknown index_type: {index_type}")
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None, selectivity=1.0):
+    """Query-time parameters matching the type of ``index`` (defaults from CONFIG).
+
+    With an ID ``selector`` keeping only a ``selectivity`` fraction of the
+    postings, IVF probes and HNSW beam width grow accordingly so approximate
+    indexes still find k allowed neighbours.
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    boost = 1.0 / max(selectivity, 1e-6)
+    if isinstance(base, faiss.IndexHNSW):
+        ef = ef_search or CONFIG["hnsw_ef_search"]
+        ef = int(min(max(ef, ef * boost), max(ef, index.ntotal)))
+        return faiss.SearchParametersHNSW(efSearch=ef, sel=selector)
+    if isinstance(base, faiss.IndexIVF):
+        probes = nprobe or CONFIG["ivf_nprobe"]
+        probes = int(min(probes * boost, base.nlist))
+        return faiss.SearchParametersIVF(nprobe=probes, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+class JobIndex:
+    """FAISS index addressed by job_id, kept in step with a MetadataStore.
+
+    Postings can be added, updated or removed individually or in batches, so a
+    daily delta costs time in proportion to the delta rather than the corpus.
+    HNSW indexes cannot remove vectors, so they only support ``add``.
+
+    When the index holds truncated vectors (CONFIG ``index_dims``), the full
+    vectors are kept in a side memmap and the top ``rescore_candidates`` hits
+    of the first stage are re-scored against them.
+    """
+
+    def __init__(self, index, store, full_vectors=None):
+        self.index = index
+        self.store = store
+        self.full_vectors = full_vectors
+        self.dim = index.d if index is not None else None
+        self._pending_ids = []
+        self._pending_vecs = []
+
+    @classmethod
+    def create(cls, dim, store, index_type=None, quantization=None, index_dims=None, full_vectors_dir=None, clear_store=True):
+        """Start an empty index; trainable types buffer vectors until ``index_train_size`` arrive."""
+        if clear_store:
+            store.clear()
+        index_dims = index_dims or CONFIG["index_dims"]
+        full_vectors_dir = full_vectors_dir or CONFIG["full_vectors_dir"]
+        full_vectors = None
+        # Always cleared: load() re-scores with whatever full vectors it finds there.
+        shutil.rmtree(full_vectors_dir, ignore_errors=True)
+        if index_dims and index_dims < dim:
+            full_vectors = MemmapVectorStore(full_vectors_dir, dim)
+            dim = index_dims
+        job_index = cls(None, store, full_vectors)
+        job_index.dim = dim
+        job_index.index_type = index_type or CONFIG["index_type"]
+        job_index.quantization = quantization or CONFIG["index_quantization"]
+        base = make_base_index(dim, job_index.index_type, quantization=job_index.quantization)
+        if base.is_trained:
+            job_index.index = faiss.IndexIDMap2(base)
+        return job_index
+
+    @classmethod
+    def load(cls, path, store, mmap=None, full_vectors_dir=None):
+        """Load a saved index, memory-mapped if ``mmap`` (default CONFIG ``index_mmap``)."""
+        if mmap is None:
+            mmap = CONFIG["index_mmap"]
+        full_vectors_dir = full_vectors_dir or CONFIG["full_vectors_dir"]
+        index = load_faiss_index(path, mmap=mmap)
+        full_vectors = None
+        if Path(full_vectors_dir, "meta.json").exists():
+            full_vectors = MemmapVectorStore(full_vectors_dir)
+            if full_vectors.dim <= index.d:
+                full_vectors = None
+        if not index.is_trained:
+            # Saved before any vector arrived: buffer again until there is data to train on.
+            job_index = cls(None, store, full_vectors)
+            job_index.dim = index.d
+            job_index.index_type = CONFIG["index_type"]
+            job_index.quantization = CONFIG["index_quantization"]
+            return job_index
+        return cls(index, store, full_vectors)
+
+    def save(self, path):
+        self._train_pending()
+        index = self.index
+        if index is None:
+            # Nothing to train on yet; an untrained, empty index tells load() to keep buffering.
+            index = faiss.IndexIDMap2(make_base_index(self.dim, self.index_type, quantization=self.quantization))
+        save_faiss_index(index, path)
+        if self.full_vectors is not None:
+            # Rows of removed and updated postings would otherwise pile up with every delta.
+            self.full_vectors.compact()
+
+    def __len__(self):
+        self._train_pending()
+        return self.index.ntotal if self.index is not None else 0
+
+    def _add_vectors(self, ids, vectors):
+        if self.full_vectors is not None:
+            # A re-added id's newest row wins; older rows are dropped by compact() on save.
+            self.full_vectors.put_many([str(i) for i in ids], vectors)
+            vectors = truncate_embeddings(vectors, self.dim)
+        if self.index is not None:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._pending_ids.append(ids)
+        self._pending_vecs.append(vectors)
+        if sum(len(v) for v in self._pending_vecs) >= CONFIG["index_train_size"]:
+            self._train_pending()
+
+    def _train_pending(self):
+        # IVF indexes cannot be trained, nor vectors added, without data: stay unbuilt until some arrive.
+        if self.index is not None or not self._pending_vecs:
+            return
+        vectors = np.vstack(self._pending_vecs)
+        ids = np.concatenate(self._pending_ids)
+        base = make_base_index(self.dim, self.index_type, n_train=len(vectors), quantization=self.quantization)
+        base.train(vectors)
+        self.index = faiss.IndexIDMap2(base)
+        self.index.add_with_ids(vectors, ids)
+        self._pending_ids, self._pending_vecs = [], []
+
+    def _check_removable(self):
+        self._train_pending()
+        if self.index is not None and isinstance(faiss.downcast_index(self.index.index), faiss.IndexHNSW):
+            raise ValueError("HNSW indexes do not support removal; rebuild with --rebuild-embeddings")
+
+    def _remove_ids(self, ids):
+        self._check_removable()
+        if self.full_vectors is not None:
+            self.full_vectors.delete_many([str(i) for i in ids])
+        if self.index is None:
+            return 0
+        return self.index.remove_ids(faiss.IDSelectorBatch(ids))
+
+    def add(self, job_ids, vectors, metadata):
+        """Insert new postings; ``metadata`` is a DataFrame aligned with ``job_ids``."""
+        ids = job_faiss_ids(job_ids)
+        vectors = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+        duplicates = self.store.existing(ids)
+        if duplicates:
+            raise ValueError(f"{len(duplicates)} job ids are already indexed; use update() instead")
+        self._add_vectors(ids, vectors)
+        self.store.upsert(ids, metadata)
+
+    def update(self, job_ids, vectors, metadata):
+        """Replace the vectors and metadata of postings that are already indexed."""
+        ids = job_faiss_ids(job_ids)
+        self._remove_ids(ids)
+        self._add_vectors(ids, np.atleast_2d(np.asarray(vectors, dtype="float32")))
+        self.store.upsert(ids, metadata)
+
+    def remove(self, job_ids):
+        ids = job_faiss_ids(job_ids)
+        removed = self._remove_ids(ids)
+        self.store.delete(ids)
+        return removed
+
+    def search(self, query_vecs, k, nprobe=None, ef_search=None, allowed_ids=None):
+        """Return ``(distances, faiss_ids)``; missing results have id -1.
+
+        ``nprobe`` / ``ef_search`` override the CONFIG search parameters for
+        IVF / HNSW indexes, e.g. to sweep the recall/latency trade-off.
+        ``allowed_ids`` (see FilterIndex) restricts results to those postings
+        inside the FAISS search itself.
+        """
+        self._train_pending()
+        query_vecs = np.atleast_2d(np.asarray(query_vecs, dtype="float32"))
+        if self.index is None:
+            return (np.full((len(query_vecs), k), np.inf, dtype="float32"),
+                    np.full((len(query_vecs), k), -1, dtype="int64"))
+        selector, selectivity = None, 1.0
+        if allowed_ids is not None:
+            if len(allowed_ids) == 0 or self.index.ntotal == 0:
+                return (np.full((len(query_vecs), k), np.inf, dtype="float32"),
+                        np.full((len(query_vecs), k), -1, dtype="int64"))
+            selector = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype="int64"))
+            selectivity = min(1.0, len(allowed_ids) / self.index.ntotal)
+        params = search_parameters(self.index, nprobe, ef_search, selector, selectivity)
+
+        if self.full_vectors is None:
+            return self.index.search(query_vecs, k, params=params)
+
+        n_candidates = max(k, CONFIG["rescore_candidates"])
+        _, candidates = self.index.search(truncate_embeddings(query_vecs, self.index.d), n_candidates, params=params)
+        return self._rescore(query_vecs, candidates, k)
+
+    def _rescore(self, query_vecs, candidates, k):
+        distances = np.full((len(query_vecs), k), np.inf, dtype="float32")
+        ids = np.full((len(query_vecs), k), -1, dtype="int64")
+        for q, (query, cand) in enumerate(zip(query_vecs, candidates)):
+            cand = cand[cand >= 0]
+            full, found = self.full_vectors.get_many([str(i) for i in cand])
+            cand = cand[found]
+            d = ((full - query) ** 2).sum(axis=1)
+            order = np.argsort(d)[:k]
+            distances[q, : len(order)] = d[order]
+            ids[q, : len(order)] = cand[order]
+        return distances, ids
+
+
+def shard_paths(n_shards):
+    """Index file and full-vector directory of each shard."""
+    stem, ext = os.path.splitext(CONFIG["faiss_index_path"])
+    return [
+        (f"{stem}.shard{i}{ext}", os.path.join(CONFIG["full_vectors_dir"], f"shard{i}"))
+        for i in range(n_shards)
+    ]
+
+
+def assign_shards(faiss_ids, cluster_ids, n_shards, shard_by):
+    if shard_by == "cluster":
+        return np.asarray(cluster_ids, dtype="int64") % n_shards
+    # Multiplicative hash so consecutive job ids spread evenly.
+    mixed = (np.asarray(faiss_ids).astype("uint64") * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    return (mixed % np.uint64(n_shards)).astype("int64")
+
+
+# Per-process cache of shards opened by search workers, keyed by file and mtime.
+_worker_shards = {}
+
+
+def _init_worker(config):
+    # Spawned workers start from config.py's defaults; apply the parent's overrides.
+    CONFIG.update(config)
+
+
+def _search_shard(index_path, full_vectors_dir, query_vecs, k, nprobe, ef_search, allowed_ids):
+    key = (index_path, os.stat(index_path).st_mtime_ns)
+    shard = _worker_shards.get(key)
+    if shard is None:
+        shard = JobIndex.load(index_path, None, mmap=True, full_vectors_dir=full_vectors_dir)
+        _worker_shards[key] = shard
+    return shard.search(query_vecs, k, nprobe, ef_search, allowed_ids)
+
+
+def merge_topk(distances, ids, k):
+    """Merge per-shard ``(nq, k)`` results into a global top-k ordered by distance."""
+    distances = np.hstack(distances)
+    ids = np.hstack(ids)
+    distances = np.where(ids >= 0, distances, np.inf)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class ShardedJobIndex:
+    """JobIndex partitioned into shards, one index file each, searched in a process pool.
+
+    Postings go to a shard by hash of job_id or by cluster_id (CONFIG
+    ``shard_by``). Searches fan out to the saved shard files and merge the
+    per-shard top-k, so results match a single exact index. Until the
+    next ``save``, an index with added, updated or removed postings is
+    searched in-process instead, as the files do not have those changes yet.
+    """
+
+    def __init__(self, shards, store, shard_by):
+        self.shards = shards
+        self.store = store
+        self.shard_by = shard_by
+        self.paths = shard_paths(len(shards))
+        self._pool = None
+        self._dirty = False
+
+    @classmethod
+    def create(cls, dim, store, n_shards=None, shard_by=None):
+        store.clear()
+        n_shards = n_shards or CONFIG["index_shards"]
+        shards = [
+            JobIndex.create(dim, store, full_vectors_dir=vectors_dir, clear_store=False)
+            for _, vectors_dir in shard_paths(n_shards)
+        ]
+        return cls(shards, store, shard_by or CONFIG["shard_by"])
+
+    @classmethod
+    def load(cls, store, n_shards=None, mmap=None, shard_by=None):
+        n_shards = n_shards or CONFIG["index_shards"]
+        shards = [
+            JobIndex.load(path, store, mmap=mmap, full_vectors_dir=vectors_dir)
+            for path, vectors_dir in shard_paths(n_shards)
+        ]
+        return cls(shards, store, shard_by or CONFIG["shard_by"])
+
+    def save(self, path=None):
+        # Shard files are derived from CONFIG; ``path`` is accepted for JobIndex compatibility.
+        for shard, (shard_path, _) in zip(self.shards, self.paths):
+            shard.save(shard_path)
+        self._dirty = False
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def _route(self, job_ids, metadata):
+        ids = job_faiss_ids(job_ids)
+        cluster_ids = metadata["cluster_id"].to_numpy() if self.shard_by == "cluster" else None
+        return assign_shards(ids, cluster_ids, len(self.shards), self.shard_by)
+
+    def add(self, job_ids, vectors, metadata):
+        job_ids = np.atleast_1d(np.asarray(job_ids, dtype=object))
+        vectors = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+        metadata = metadata.reset_index(drop=True)
+        shard_of = self._route(job_ids, metadata)
+        for i, shard in enumerate(self.shards):
+            mask = shard_of == i
+            if mask.any():
+                shard.add(job_ids[mask].tolist(), vectors[mask], metadata[mask])
+                self._dirty = True
+
+    def update(self, job_ids, vectors, metadata):
+        # A posting may move shard when its cluster changes, so drop it everywhere first.
+        self.remove(job_ids)
+        self.add(job_ids, vectors, metadata)
+
+    def remove(self, job_ids):
+        ids = job_faiss_ids(job_ids)
+        removed = 0
+        for shard in self.shards:
+            removed += shard._remove_ids(ids)
+        self.store.delete(ids)
+        self._dirty = True
+        return removed
+
+    def search(self, query_vecs, k, nprobe=None, ef_search=None, allowed_ids=None):
+        """Scatter the queries to every shard and gather the global top-k."""
+        query_vecs = np.atleast_2d(np.asarray(query_vecs, dtype="float32"))
+        shard_allowed = [allowed_ids] * len(self.shards)
+        if allowed_ids is not None and self.shard_by == "hash":
+            # Hash routing is a pure function of the id, so each shard only needs its own share.
+            allowed_ids = np.asarray(allowed_ids, dtype="int64")
+            shard_of = assign_shards(allowed_ids, None, len(self.shards), self.shard_by)
+            shard_allowed = [allowed_ids[shard_of == i] for i in range(len(self.shards))]
+        # Cluster routing can leave shards without postings; they are saved but never searched.
+        active = [i for i, shard in enumerate(self.shards) if len(shard)]
+        if not active:
+            return (np.full((len(query_vecs), k), np.inf, dtype="float32"),
+                    np.full((len(query_vecs), k), -1, dtype="int64"))
+        if self._dirty:
+            results = [self.shards[i].search(query_vecs, k, nprobe, ef_search, shard_allowed[i]) for i in active]
+            return merge_topk([d for d, _ in results], [i for _, i in results], k)
+        if self._pool is None:
+            # Not fork: the server and bulk matching call this from threads, and a forked child
+            # can inherit a lock some other thread held at the time.
+            self._pool = ProcessPoolExecutor(
+                max_workers=CONFIG["shard_workers"] or len(self.shards),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(dict(CONFIG),),
+            )
+        futures = [
+            self._pool.submit(_search_shard, *self.paths[i], query_vecs, k, nprobe, ef_search, shard_allowed[i])
+            for i in active
+        ]
+        results = [f.result() for f in futures]
+        return merge_topk([d for d, _ in results], [i for _, i in results], k)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def create_job_index(dim, store):
+    """Empty single or sharded index, depending on CONFIG ``index_shards``."""
+    if CONFIG["index_shards"] > 1:
+        return ShardedJobIndex.create(dim, store)
+    return JobIndex.create(dim, store)
+
+
+def load_job_index(store, mmap=None):
+    if CONFIG["index_shards"] > 1:
+        return ShardedJobIndex.load(store, mmap=mmap)
+    return JobIndex.load(CONFIG["faiss_index_path"], store, mmap=mmap)
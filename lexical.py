@@ -0,0 +1,377 @@
+# lexical.py
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from config import CONFIG
+
+# Bumped when the on-disk layout changes, so older saved models are rebuilt.
+LEXICAL_FORMAT = 2
+
+
+def make_vectorizer(vocabulary=None):
+    # Same settings as the BoW evaluation, so both paths score text identically.
+    return TfidfVectorizer(
+        max_features=CONFIG["tfidf_max_features"] if vocabulary is None else None,
+        stop_words="english",
+        lowercase=True,
+        vocabulary=vocabulary,
+    )
+
+
+def make_hashing_vectorizer(n_features):
+    # Raw counts; IDF weighting and normalization are applied by LexicalModel.
+    return HashingVectorizer(
+        n_features=n_features,
+        stop_words="english",
+        lowercase=True,
+        alternate_sign=False,
+        norm=None,
+    )
+
+
+def _update_corpus_hash(digest, ids, texts):
+    for i, text in zip(ids, texts):
+        digest.update(f"{int(i)}\x00{text}\x01".encode("utf-8"))
+
+
+def corpus_hash(ids, texts):
+    """Short digest of the (id, text) pairs a model is fitted on."""
+    digest = hashlib.sha256()
+    _update_corpus_hash(digest, ids, texts)
+    return digest.hexdigest()[:16]
+
+
+def _write_json(path, payload):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+# Saved models are memory-mapped by load(), so their files must never be
+# rewritten in place: a reader would see truncated pages and die of SIGBUS.
+# Each save writes a new generation directory, and the CURRENT pointer file
+# is swapped to it atomically, as utils.save_faiss_index does for the index.
+
+def new_generation(directory):
+    """Private directory under ``directory`` to write a model into before ``publish``."""
+    path = Path(directory) / f".tmp-{uuid.uuid4().hex}"
+    path.mkdir(parents=True)
+    return path
+
+
+def publish(directory, staging):
+    """Make the model written in ``staging`` the one ``directory`` loads.
+
+    The generation that was live until now is kept for readers that are just
+    opening it; older ones are deleted (already mapped pages stay valid after
+    an unlink, and ``read_generation`` retries readers that lose the race).
+    """
+    directory = Path(directory)
+    previous = current_generation(directory)
+    generation = directory / staging.name.replace(".tmp-", "gen-", 1)
+    os.rename(staging, generation)
+    tmp = directory / f"CURRENT.{generation.name}.tmp"
+    tmp.write_text(generation.name, encoding="utf-8")
+    os.replace(tmp, directory / "CURRENT")
+    for child in directory.glob("gen-*"):
+        if child not in (generation, previous):
+            shutil.rmtree(child, ignore_errors=True)
+    return generation
+
+
+def current_generation(directory):
+    """Directory holding the live model of ``directory``, or None if nothing was saved."""
+    directory = Path(directory)
+    pointer = directory / "CURRENT"
+    if pointer.exists():
+        return directory / pointer.read_text(encoding="utf-8").strip()
+    # Models saved before generations were introduced sit directly in the directory.
+    return directory if (directory / "meta.json").exists() else None
+
+
+def read_generation(directory, read, retries=5):
+    """``read(generation)`` on the live generation of ``directory``, or None if nothing was saved.
+
+    A reader that resolved CURRENT just before two publishes finds its
+    generation deleted; it then retries on the one CURRENT points to now.
+    """
+    for attempt in range(retries + 1):
+        generation = current_generation(directory)
+        if generation is None:
+            return None
+        try:
+            return read(generation)
+        except FileNotFoundError:
+            if attempt == retries or current_generation(directory) == generation:
+                raise
+
+
+def read_meta(directory):
+    """``meta.json`` of the live model of ``directory``, or None."""
+    def read(generation):
+        with open(generation / "meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return read_generation(directory, read)
+
+
+def load_csr_arrays(directory, names, mmap):
+    """``(data, indices, indptr)`` saved as ``names`` in ``directory``, memory-mapped if ``mmap``.
+
+    Empty matrices are read into memory: a zero-length region cannot be mapped.
+    """
+    data_name, indices_name, indptr_name = names
+    indptr = np.load(directory / indptr_name, mmap_mode="r" if mmap else None)
+    mmap_mode = "r" if mmap and indptr[-1] > 0 else None
+    return (np.load(directory / data_name, mmap_mode=mmap_mode),
+            np.load(directory / indices_name, mmap_mode=mmap_mode),
+            indptr)
+
+
+def _update_meta(directory, **changes):
+    meta = read_meta(directory)
+    meta.update(changes)
+    _write_json(current_generation(directory) / "meta.json", meta)
+
+
+class LexicalModel:
+    """TF-IDF model of the job descriptions, used to score dense-retrieval candidates.
+
+    Rows of ``matrix`` are L2-normalized TF-IDF vectors, aligned with the sorted
+    FAISS ids in ``ids``, so a candidate's row is one ``searchsorted`` away.
+    ``version`` is the metadata store version the model was built from and
+    ``corpus_hash`` identifies the (id, text) pairs it was fitted on.
+
+    The vocabulary is either fitted (``tfidf``) or hashed (``hashing``, built
+    out of core from streamed batches); for the latter ``idf`` is kept apart
+    from the vectorizer.
+    """
+
+    def __init__(self, vectorizer, matrix, ids, version, corpus_hash=None, idf=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.ids = ids
+        self.version = version
+        self.corpus_hash = corpus_hash
+        self.idf = idf
+
+    @property
+    def kind(self):
+        return "tfidf" if self.idf is None else "hashing"
+
+    def transform(self, texts):
+        """L2-normalized TF-IDF rows for ``texts``, in the space of ``matrix``."""
+        if self.idf is None:
+            return self.vectorizer.transform(texts)
+        return normalize(self.vectorizer.transform(texts).multiply(self.idf).tocsr())
+
+    @classmethod
+    def fit(cls, ids, texts, version=None):
+        """Fit the vocabulary and IDF on ``texts`` in memory."""
+        vectorizer = make_vectorizer()
+        matrix = vectorizer.fit_transform(texts).tocsr()
+        return cls(vectorizer, matrix, np.asarray(ids, dtype="int64"), version, corpus_hash(ids, texts))
+
+    @classmethod
+    def fit_hashing(cls, batches, directory, version=None, n_features=None):
+        """Build a hashed TF-IDF model from ``(ids, texts)`` batches without holding the corpus.
+
+        Raw term counts are appended to disk while document frequencies
+        accumulate; a second pass over the memory-mapped counts applies the
+        IDF and normalizes the rows. The model is written to ``directory``.
+        """
+        target, directory = directory, new_generation(directory)
+        vectorizer = make_hashing_vectorizer(n_features or CONFIG["lexical_hashing_features"])
+        n_features = vectorizer.n_features
+        doc_freq = np.zeros(n_features, dtype="int64")
+        indptr, all_ids = [0], []
+        digest = hashlib.sha256()
+        with open(directory / "counts.tmp", "wb") as counts_f, open(directory / "indices.tmp", "wb") as indices_f:
+            for ids, texts in batches:
+                counts = vectorizer.transform(texts)
+                doc_freq += np.bincount(counts.indices, minlength=n_features)
+                counts_f.write(counts.data.astype("float32").tobytes())
+                indices_f.write(counts.indices.astype("int32").tobytes())
+                indptr.extend((counts.indptr[1:] + indptr[-1]).tolist())
+                all_ids.extend(int(i) for i in ids)
+                _update_corpus_hash(digest, ids, texts)
+
+        n_docs, nnz = len(all_ids), indptr[-1]
+        indptr = np.asarray(indptr, dtype="int64")
+        # Smoothed IDF, as TfidfVectorizer computes it.
+        idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+        counts = np.memmap(directory / "counts.tmp", dtype="float32", mode="r", shape=(nnz,)) if nnz else np.empty(0, "float32")
+        indices = np.memmap(directory / "indices.tmp", dtype="int32", mode="r", shape=(nnz,)) if nnz else np.empty(0, "int32")
+        # A zero-length memmap cannot be created: a corpus without any term is saved as plain arrays.
+        data = np.lib.format.open_memmap(directory / "matrix_data.npy", mode="w+", dtype="float32", shape=(nnz,)) if nnz else np.empty(0, "float32")
+        for row_start in range(0, n_docs, 65536):
+            row_end = min(row_start + 65536, n_docs)
+            lo, hi = indptr[row_start], indptr[row_end]
+            weights = counts[lo:hi] * idf[indices[lo:hi]]
+            rows = np.repeat(np.arange(row_end - row_start), np.diff(indptr[row_start:row_end + 1]))
+            norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=row_end - row_start))
+            data[lo:hi] = weights / np.where(norms > 0, norms, 1)[rows]
+        if nnz:
+            data.flush()
+        else:
+            np.save(directory / "matrix_data.npy", data)
+        np.save(directory / "matrix_indices.npy", indices)
+        del data, counts, indices
+        os.remove(directory / "counts.tmp")
+        os.remove(directory / "indices.tmp")
+
+        np.save(directory / "matrix_indptr.npy", indptr)
+        np.save(directory / "idf.npy", idf)
+        np.save(directory / "ids.npy", np.asarray(all_ids, dtype="int64"))
+        meta = {"format": LEXICAL_FORMAT, "kind": "hashing", "n_features": n_features, "shape": [n_docs, n_features],
+                "version": version, "corpus_hash": digest.hexdigest()[:16]}
+        _write_json(directory / "meta.json", meta)
+        publish(target, directory)
+        return cls.load(target)
+
+    @classmethod
+    def build(cls, store, directory=None):
+        """Build the model of every description in ``store`` and save it to ``directory``.
+
+        CONFIG ``lexical_vectorizer`` chooses an in-memory ``tfidf`` fit or the
+        out-of-core ``hashing`` build.
+        """
+        directory = Path(directory or CONFIG["lexical_model_dir"])
+        if CONFIG["lexical_vectorizer"] == "hashing":
+            batches = (
+                (batch["faiss_id"].to_numpy(dtype="int64"), batch["description"].fillna("").tolist())
+                for batch in store.iter_columns(["description"], CONFIG["ingest_batch_rows"])
+            )
+            return cls.fit_hashing(batches, directory, store.version)
+        df = store.read_columns(["description"]).sort_values("faiss_id")
+        model = cls.fit(df["faiss_id"].to_numpy(dtype="int64"), df["description"].fillna("").tolist(), store.version)
+        model.save(directory)
+        return model
+
+    def save(self, directory):
+        target, directory = directory, new_generation(directory)
+        if self.kind == "tfidf":
+            _write_json(directory / "vocabulary.json", {term: int(col) for term, col in self.vectorizer.vocabulary_.items()})
+            np.save(directory / "idf.npy", self.vectorizer.idf_)
+        else:
+            np.save(directory / "idf.npy", self.idf)
+        np.save(directory / "ids.npy", self.ids)
+        # Plain .npy arrays rather than an npz archive, so load() can memory-map them.
+        np.save(directory / "matrix_data.npy", self.matrix.data)
+        np.save(directory / "matrix_indices.npy", self.matrix.indices)
+        np.save(directory / "matrix_indptr.npy", self.matrix.indptr)
+        meta = {"format": LEXICAL_FORMAT, "kind": self.kind, "n_features": self.matrix.shape[1], "shape": list(self.matrix.shape),
+                "version": self.version, "corpus_hash": self.corpus_hash}
+        _write_json(directory / "meta.json", meta)
+        publish(target, directory)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a saved model; the CSR arrays are memory-mapped unless ``mmap`` is False."""
+        model = read_generation(directory, lambda generation: cls._load_generation(generation, mmap))
+        if model is None:
+            raise FileNotFoundError(f"no saved lexical model in {directory}")
+        return model
+
+    @classmethod
+    def _load_generation(cls, directory, mmap):
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = sp.csr_matrix(
+            load_csr_arrays(directory, ("matrix_data.npy", "matrix_indices.npy", "matrix_indptr.npy"), mmap),
+            shape=tuple(meta["shape"]),
+            copy=False,
+        )
+        idf = np.load(directory / "idf.npy")
+        ids = np.load(directory / "ids.npy")
+        if meta["kind"] == "hashing":
+            return cls(make_hashing_vectorizer(meta["n_features"]), matrix, ids, meta["version"], meta["corpus_hash"], idf)
+        with open(directory / "vocabulary.json", "r", encoding="utf-8") as f:
+            vectorizer = make_vectorizer(json.load(f))
+        vectorizer.idf_ = idf
+        return cls(vectorizer, matrix, ids, meta["version"], meta["corpus_hash"])
+
+    @classmethod
+    def _load_saved(cls, directory):
+        meta = read_meta(directory)
+        if meta is None:
+            return None
+        # Models saved in an older layout or with another vectorizer are rebuilt.
+        if meta.get("format") != LEXICAL_FORMAT or meta.get("kind") != CONFIG["lexical_vectorizer"]:
+            return None
+        return cls.load(directory)
+
+    @classmethod
+    def load_or_build(cls, store, directory=None):
+        """Load the saved model, refitting it only if the store's descriptions changed."""
+        directory = Path(directory or CONFIG["lexical_model_dir"])
+        model = cls._load_saved(directory)
+        if model is not None and model.version == store.version:
+            return model
+        if model is not None:
+            # Writes that left every description untouched (e.g. metadata
+            # corrections) only need the saved model re-stamped.
+            df = store.read_columns(["description"]).sort_values("faiss_id")
+            if model.corpus_hash == corpus_hash(df["faiss_id"].tolist(), df["description"].fillna("").tolist()):
+                model.version = store.version
+                _update_meta(directory, version=store.version)
+                return model
+        return cls.build(store, directory)
+
+    @classmethod
+    def load_or_fit(cls, directory, ids, texts):
+        """Load the model saved in ``directory`` if it was fitted on exactly ``(ids, texts)``."""
+        directory = Path(directory)
+        model = cls._load_saved(directory)
+        if model is not None and model.corpus_hash == corpus_hash(ids, texts):
+            return model
+        if CONFIG["lexical_vectorizer"] == "hashing":
+            step = CONFIG["ingest_batch_rows"]
+            batches = ((ids[i:i + step], texts[i:i + step]) for i in range(0, len(texts), step))
+            return cls.fit_hashing(batches, directory)
+        model = cls.fit(ids, texts)
+        model.save(directory)
+        return model
+
+    def score(self, query_texts, candidate_ids):
+        """Cosine similarity of each query to its ``(nq, c)`` candidates; unknown ids score 0."""
+        candidate_ids = np.asarray(candidate_ids, dtype="int64")
+        nq, c = candidate_ids.shape
+        flat = candidate_ids.ravel()
+        rows = np.clip(np.searchsorted(self.ids, flat), 0, len(self.ids) - 1)
+        known = self.ids[rows] == flat
+
+        queries = self.transform(query_texts)
+        # Pair every candidate row with its query row and take the row-wise dot product.
+        pairs = self.matrix[rows].multiply(queries[np.repeat(np.arange(nq), c)])
+        scores = np.asarray(pairs.sum(axis=1)).ravel()
+        return np.where(known, scores, 0.0).reshape(nq, c)
+
+
+def _minmax(x):
+    low = x.min(axis=1, keepdims=True)
+    span = x.max(axis=1, keepdims=True) - low
+    return np.where(span > 0, (x - low) / np.where(span > 0, span, 1), 1.0)
+
+
+def fuse_scores(distances, lexical_scores, weight, method="weighted", rrf_k=60):
+    """Fused relevance (higher is better) of dense candidates and their lexical scores.
+
+    ``weighted`` mixes min-max normalized dense similarity and lexical score as
+    ``weight * dense + (1 - weight) * lexical``; ``rrf`` applies the same weights
+    to reciprocal-rank fusion of the two rankings.
+    """
+    dense_sim = 1 / (1 + distances)
+    if method == "rrf":
+        dense_rank = np.argsort(np.argsort(-dense_sim, axis=1, kind="stable"), axis=1)
+        lexical_rank = np.argsort(np.argsort(-lexical_scores, axis=1, kind="stable"), axis=1)
+        return weight / (rrf_k + dense_rank + 1) + (1 - weight) / (rrf_k + lexical_rank + 1)
+    return weight * _minmax(dense_sim) + (1 - weight) * _minmax(lexical_scores)
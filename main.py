@@ -1,5 +1,6 @@
 import argparse
-from ingest import build_embeddings
+import tracing
+from ingest import build_embeddings, apply_job_delta
 from evaluate_retrieval import evaluate_all_clusters
 from evaluate_retrieval_bow import evaluate_all_clusters_bow
 
@@ -7,18 +8,62 @@ from evaluate_retrieval_bow import evaluate_all_clusters_bow
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--rebuild-embeddings", action="store_true", help="Force rebuilding embeddings")
+    parser.add_argument("--apply-delta", type=str, metavar="PARQUET", help="Add or update the postings in this parquet file")
+    parser.add_argument("--expire", type=str, metavar="TXT", help="Remove the job_ids listed in this file (one per line)")
     parser.add_argument("--method", type=str, default="bow", choices=["embedding", "bow"])
+    parser.add_argument("--full-corpus", action="store_true", help="Run the BoW evaluation against every posting, not just the subset")
+    parser.add_argument("--bow-scoring", type=str, default="tfidf", choices=["tfidf", "bm25"])
+    parser.add_argument("--bulk-match", type=str, metavar="PARQUET", help="Retrieve offers and generate an analysis for every CV in this file")
+    parser.add_argument("--bulk-output", type=str, default=None, metavar="DIR", help="Part files of --bulk-match (default: CONFIG bulk_output_dir)")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP retrieval service instead of an evaluation")
+    parser.add_argument("--host", type=str, default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--trace", nargs="?", const="", default=None, metavar="JSON",
+                        help="Record stage timings and write a trace file (default: CONFIG trace_path)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
     args = parser.parse_args()
 
+    if args.trace is not None or args.metrics_port:
+        tracing.enable()
+    if args.metrics_port:
+        tracing.serve_metrics(args.metrics_port)
+    try:
+        run(args)
+    finally:
+        if args.trace is not None:
+            path = tracing.export_trace(args.trace or None)
+            print(f"\nSlowest stages (trace written to {path}):")
+            for stage in tracing.summary()[:10]:
+                print(f"  {stage['stage']:<28} {stage['calls']:>6} calls {stage['total_s']:>9.3f}s total {stage['mean_ms']:>9.2f}ms mean")
+
+
+def run(args):
     if args.rebuild_embeddings:
         build_embeddings()
     else:
         print("Skipping embedding rebuild (use --rebuild-embeddings to force it)")
 
-    if args.method == "embedding":
+    if args.apply_delta or args.expire:
+        expired = []
+        if args.expire:
+            with open(args.expire, "r", encoding="utf-8") as f:
+                expired = [line.strip() for line in f if line.strip()]
+        apply_job_delta(args.apply_delta, expired)
+
+    if args.serve:
+        from server import run_server
+        run_server(args.host, args.port)
+    elif args.bulk_match:
+        from bulk_match import match_cvs
+        stats = match_cvs(args.bulk_match, args.bulk_output)
+        print(f"Matched {stats['cvs']} CVs in {stats['elapsed_s']:.1f}s ({stats['cvs_per_s']:.2f} CVs/s): "
+              f"{stats['batches_written']} batches written, {stats['batches_skipped']} already done, {stats['errors']} errors.")
+        if stats["response_cache"] is not None:
+            print(f"Response cache hit rate: {stats['response_cache']['hit_rate']:.1%}")
+    elif args.method == "embedding":
         evaluate_all_clusters()
     else:
-        evaluate_all_clusters_bow()
+        evaluate_all_clusters_bow(full_corpus=args.full_corpus, scoring=args.bow_scoring)
 
 
 
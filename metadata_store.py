@@ -0,0 +1,112 @@
+# metadata_store.py
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from config import CONFIG
+
+# SQLite caps the number of bound parameters per statement.
+MAX_PARAMS = 900
+
+
+class MetadataStore:
+    """Job posting metadata in SQLite, keyed by the FAISS id of each posting."""
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        # WAL lets readers query while a delta is being written; mmap serves
+        # hot pages from the OS page cache instead of read() copies.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA mmap_size={256 * 1024 * 1024}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (faiss_id INTEGER PRIMARY KEY)")
+
+    def columns(self):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+
+    def _ensure_columns(self, columns):
+        existing = set(self.columns())
+        for col in columns:
+            if col not in existing:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN "{col}"')
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def upsert(self, faiss_ids, df):
+        df = df.reset_index(drop=True)
+        self._ensure_columns(df.columns)
+        cols = ["faiss_id"] + list(df.columns)
+        values = df.astype(object).where(df.notna(), None)
+        rows = [(int(fid), *(v.item() if isinstance(v, np.generic) else v for v in row))
+                for fid, row in zip(faiss_ids, values.itertuples(index=False, name=None))]
+        placeholders = ", ".join("?" for _ in cols)
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO jobs ({col_list}) VALUES ({placeholders})", rows)
+            self._bump_version()
+
+    def delete(self, faiss_ids):
+        ids = [int(i) for i in faiss_ids]
+        with self.conn:
+            for i in range(0, len(ids), MAX_PARAMS):
+                chunk = ids[i : i + MAX_PARAMS]
+                self.conn.execute(f"DELETE FROM jobs WHERE faiss_id IN ({', '.join('?' for _ in chunk)})", chunk)
+            self._bump_version()
+
+    def existing(self, faiss_ids):
+        """Return the subset of ``faiss_ids`` already present in the store."""
+        ids = [int(i) for i in faiss_ids]
+        found = set()
+        for i in range(0, len(ids), MAX_PARAMS):
+            chunk = ids[i : i + MAX_PARAMS]
+            query = f"SELECT faiss_id FROM jobs WHERE faiss_id IN ({', '.join('?' for _ in chunk)})"
+            found.update(row[0] for row in self.conn.execute(query, chunk))
+        return found
+
+    def get_many(self, faiss_ids, columns=None):
+        """Return ``columns`` (default: all) for ``faiss_ids`` as a DataFrame indexed by faiss_id.
+
+        Rows come back in the requested order; unknown ids yield all-null rows.
+        Only the requested rows and columns are read from disk.
+        """
+        ids = [int(i) for i in faiss_ids]
+        if columns is None:
+            columns = [c for c in self.columns() if c != "faiss_id"]
+        col_list = ", ".join(f'"{c}"' for c in ["faiss_id"] + list(columns))
+        rows = []
+        for i in range(0, len(ids), MAX_PARAMS):
+            chunk = ids[i : i + MAX_PARAMS]
+            query = f"SELECT {col_list} FROM jobs WHERE faiss_id IN ({', '.join('?' for _ in chunk)})"
+            rows.extend(self.conn.execute(query, chunk))
+        df = pd.DataFrame(rows, columns=["faiss_id"] + list(columns)).set_index("faiss_id")
+        return df.reindex(ids)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS jobs")
+            self.conn.execute("CREATE TABLE jobs (faiss_id INTEGER PRIMARY KEY)")
+            self._bump_version()
+
+    @property
+    def version(self):
+        """Counter bumped on every write, used to detect stale derived data."""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _bump_version(self):
+        self.conn.execute(f"PRAGMA user_version={self.version + 1}")
+
+    def read_columns(self, columns):
+        """Return ``faiss_id`` and ``columns`` for every row, e.g. to build filter structures."""
+        col_list = ", ".join(f'"{c}"' for c in ["faiss_id"] + list(columns))
+        return pd.read_sql_query(f"SELECT {col_list} FROM jobs", self.conn)
+
+    def iter_columns(self, columns, batch_rows):
+        """Like ``read_columns``, but yields ``batch_rows`` rows at a time in faiss_id order."""
+        col_list = ", ".join(f'"{c}"' for c in ["faiss_id"] + list(columns))
+        yield from pd.read_sql_query(f"SELECT {col_list} FROM jobs ORDER BY faiss_id", self.conn, chunksize=batch_rows)
+
+
+def open_metadata_store():
+    return MetadataStore(Path(CONFIG["sqlite_path"]) / "job_offers.db")
@@ -1,31 +1,43 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
+from config import CONFIG
+from utils import iter_parquet_batches
 
 # --- Fichiers source ---
-clusters_path = Path("data/cluster_reps_checkpoint_final_20251106_163826.parquet")
-jobs_path = Path("data/sampled_engineers_with_clusters_20251105_175242.parquet")
+clusters_path = Path(CONFIG["clusters_path"])
+jobs_path = Path(CONFIG["jobs_path"])
 
-# --- Chargement ---
-df_clusters = pd.read_parquet(clusters_path)
-df_jobs = pd.read_parquet(jobs_path)
+# --- Chargement (seules les colonnes utiles du petit fichier) ---
+df_clusters = pd.read_parquet(clusters_path, columns=["cluster_id", "cv_standard"])
 
-# --- Sélection de 10 clusters aléatoires ---
+# --- Sélection de 30 clusters aléatoires ---
 selected_clusters = df_clusters["cluster_id"].dropna().sample(30, random_state=42).tolist()
 print("Clusters sélectionnés :", selected_clusters)
 
 # --- CV correspondants (dans le petit fichier) ---
 cv_subset = df_clusters[df_clusters["cluster_id"].isin(selected_clusters)][["cluster_id", "cv_standard"]]
 
-# --- Job descriptions associées (dans le grand fichier) ---
-jobs_subset = df_jobs[df_jobs["cluster_label"].isin(selected_clusters)][["cluster_label", "description"]]
-jobs_subset = jobs_subset.rename(columns={"cluster_label": "cluster_id"})
-
 # --- Sauvegarde du sous-ensemble pour embedding ---
 output_dir = Path("data/subset")
 output_dir.mkdir(exist_ok=True)
 
 cv_subset.to_parquet(output_dir / "selected_cvs.parquet", index=False)
-jobs_subset.to_parquet(output_dir / "selected_job_descriptions.parquet", index=False)
+
+# --- Job descriptions associées (lecture en flux du grand fichier, filtre poussé au scan) ---
+predicate = ds.field("cluster_label").isin(selected_clusters)
+writer = None
+n_jobs = 0
+for batch in iter_parquet_batches(jobs_path, ["cluster_label", "description"], predicate, CONFIG["ingest_batch_rows"]):
+    table = pa.Table.from_batches([batch]).rename_columns(["cluster_id", "description"])
+    if writer is None:
+        writer = pq.ParquetWriter(output_dir / "selected_job_descriptions.parquet", table.schema)
+    writer.write_table(table)
+    n_jobs += table.num_rows
+if writer is not None:
+    writer.close()
 
 print(f"{len(cv_subset)} CV sauvegardés")
-print(f"{len(jobs_subset)} descriptions sauvegardées")
+print(f"{n_jobs} descriptions sauvegardées")
@@ -0,0 +1,86 @@
+# response_cache.py
+import hashlib
+import json
+import threading
+from config import CONFIG
+from disk_cache import DiskCache
+from embedding_cache import normalize_text
+from tracing import count
+
+
+def response_key(cv_text, job_ids, model, temperature, max_tokens, context_tokens):
+    """Hash of everything the generated answer depends on.
+
+    ``job_ids`` are kept in order: the prompt lists the offers by rank.
+    ``context_tokens`` is part of the key because it changes what the packer
+    puts in the prompt.
+    """
+    payload = json.dumps(
+        {
+            "cv": hashlib.sha256(normalize_text(cv_text).encode("utf-8")).hexdigest(),
+            "jobs": [str(j) for j in job_ids],
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "context_tokens": context_tokens,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def docs_key(retrieved_docs):
+    """Stand-in for job ids when the caller only has the offers' texts."""
+    return [hashlib.sha256(normalize_text(d).encode("utf-8")).hexdigest()[:16] for d in retrieved_docs]
+
+
+class ResponseCache:
+    """Generated answers in a DiskCache, with TTL and size-bounded LRU eviction."""
+
+    def __init__(self, path, max_bytes, ttl_s=None):
+        self.disk = DiskCache(path, max_bytes, ttl_s)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, cv_text, job_ids):
+        return response_key(cv_text, job_ids, CONFIG["llm_model"], CONFIG["llm_temperature"],
+                            CONFIG["llm_max_tokens"], CONFIG["llm_context_tokens"])
+
+    def get(self, key):
+        blob = self.disk.get(key)
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count("response_cache_misses_total" if blob is None else "response_cache_hits_total")
+        return blob.decode("utf-8") if blob is not None else None
+
+    def set(self, key, text):
+        self.disk.set(key, text.encode("utf-8"))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.disk),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide cache from CONFIG, or None when ``response_cache_path`` is unset."""
+    global _cache
+    if CONFIG.get("response_cache_path") is None:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(CONFIG["response_cache_path"], CONFIG["response_cache_max_bytes"],
+                                   CONFIG["response_cache_ttl_s"])
+        return _cache
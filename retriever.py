@@ -1,33 +1,211 @@
 # retriever.py
+import os
+import threading
 import numpy as np
-import pandas as pd
-from openai import OpenAI
 from config import CONFIG
-from utils import read_secret_key, load_faiss_index
-
-def retrieve_similar_offers(query_text):
-    # Load OpenAI client
-    key = read_secret_key(CONFIG["openai_key_path"])
-    client = OpenAI(api_key=key)
-
-    # Load FAISS index + metadata
-    index = load_faiss_index(CONFIG["faiss_index_path"])
-    df = pd.read_parquet("data/sqlite/job_offers.parquet")
-
-    # Embed the query
-    resp = client.embeddings.create(model=CONFIG["embedding_model"], input=[query_text])
-    query_vec = np.array(resp.data[0].embedding, dtype="float32").reshape(1, -1)
-
-    # Search in FAISS
-    distances, indices = index.search(query_vec, CONFIG["retrieval_top_k"])
-
-    # Retrieve corresponding job offers
-    results = []
-    for idx in indices[0]:
-        row = df.iloc[idx]
-        title = str(row["title_translated"])
-        desc = str(row["description"])
-        job_id = row["job_id"]
-        results.append(f"[Job {job_id}] {title}\n\n{desc}")
-
-    return results
+from embedding_provider import make_embedding_provider
+from embedding_cache import QueryEmbeddingCache
+from job_index import load_job_index
+from metadata_store import open_metadata_store
+from filter_index import FilterIndex
+from lexical import LexicalModel, fuse_scores
+from bm25 import BM25Index
+from tracing import span
+
+
+class _OfferLoader:
+    """Fetches metadata columns for every hit of a batch at once, on first access."""
+
+    def __init__(self, retriever, faiss_ids):
+        self.retriever = retriever
+        self.faiss_ids = faiss_ids
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            # The retriever hands out a SQLite connection for the calling thread.
+            with span("retriever.metadata", column=name, rows=len(self.faiss_ids)):
+                values = self.retriever.store.get_many(self.faiss_ids, [name])[name]
+            self._columns[name] = dict(zip(self.faiss_ids, values))
+        return self._columns[name]
+
+
+class RetrievalHit:
+    """One ranked result of a query; metadata and text are loaded lazily, batch-wide."""
+
+    __slots__ = ("faiss_id", "distance", "rank", "score", "_loader")
+
+    def __init__(self, faiss_id, distance, rank, loader, score=None):
+        self.faiss_id = faiss_id
+        self.distance = distance
+        self.rank = rank
+        self.score = score  # fused relevance when the rerank stage ran
+        self._loader = loader
+
+    @property
+    def job_id(self):
+        return self.get("job_id")
+
+    def get(self, column):
+        return self._loader.column(column)[self.faiss_id]
+
+    @property
+    def text(self):
+        return f"[Job {self.job_id}] {self.get('title_translated')}\n\n{self.get('description')}"
+
+    def __repr__(self):
+        return f"RetrievalHit(job_id={self.job_id!r}, distance={self.distance:.4f}, rank={self.rank})"
+
+
+class Retriever:
+    """Long-lived retrieval state: embedding provider, job index, metadata store and filters.
+
+    Everything is opened once and reused across queries; the OpenAI provider
+    keeps a pool of TLS connections alive. ``search`` may be called from several
+    threads: FAISS searches are read-only, and each thread gets its own SQLite
+    connection. The index is reloaded when its file changes on disk.
+    """
+
+    def __init__(self):
+        self.embedder = make_embedding_provider()
+        self.query_cache = QueryEmbeddingCache(
+            self.embedder.name,
+            CONFIG["query_cache_size"],
+            CONFIG["query_cache_path"],
+            CONFIG["query_cache_max_bytes"],
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._filter_index = None
+        self._lexical_model = None
+        self._load_index()
+
+    def _index_mtime(self):
+        path = CONFIG["faiss_index_path"]
+        if CONFIG["index_shards"] > 1:
+            stem, ext = os.path.splitext(path)
+            path = f"{stem}.shard0{ext}"
+        return os.stat(path).st_mtime_ns
+
+    def _load_index(self):
+        self._mtime = self._index_mtime()
+        with span("retriever.index_load"):
+            self.job_index = load_job_index(self.store)
+
+    def _maybe_reload(self):
+        if self._index_mtime() != self._mtime:
+            with self._lock:
+                if self._index_mtime() != self._mtime:
+                    self._load_index()
+
+    @property
+    def store(self):
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = self._local.store = open_metadata_store()
+        return store
+
+    def _allowed_ids(self, filters):
+        filter_index = self._filter_index
+        if filter_index is None or filter_index.version != self.store.version:
+            with self._lock:
+                filter_index = self._filter_index = FilterIndex.load_or_build(self.store)
+        return filter_index.allowed_ids(filters)
+
+    def embed(self, texts):
+        """Embed ``texts`` through the query cache; returns a float32 matrix."""
+        with span("retriever.embed", queries=len(texts)):
+            return self.query_cache.embed(list(texts), self.embedder.embed)
+
+    def _lexical(self):
+        model = self._lexical_model
+        if model is None or model.version != self.store.version:
+            with self._lock:
+                scorer = BM25Index if CONFIG["lexical_scorer"] == "bm25" else LexicalModel
+                model = self._lexical_model = scorer.load_or_build(self.store)
+        return model
+
+    def _search(self, query_vecs, k, filters, query_texts):
+        k = k or CONFIG["retrieval_top_k"]
+        self._maybe_reload()
+        allowed_ids = None
+        if filters:
+            with span("retriever.filters"):
+                allowed_ids = self._allowed_ids(filters)
+        if query_texts is None or not CONFIG["use_rerank"]:
+            with span("retriever.search", queries=len(query_vecs), k=k):
+                distances, ids = self.job_index.search(query_vecs, k, allowed_ids=allowed_ids)
+            return distances, ids, None
+
+        # Over-fetch dense candidates, then re-order them with the lexical model.
+        n_candidates = max(k, CONFIG["rerank_candidates"])
+        with span("retriever.search", queries=len(query_vecs), k=n_candidates):
+            distances, ids = self.job_index.search(query_vecs, n_candidates, allowed_ids=allowed_ids)
+        with span("retriever.rerank", scorer=CONFIG["lexical_scorer"]):
+            lexical_scores = self._lexical().score(query_texts, ids)
+            fused = fuse_scores(distances, lexical_scores, CONFIG["rerank_weight"], CONFIG["rerank_method"], CONFIG["rrf_k"])
+            fused = np.where(ids >= 0, fused, -np.inf)
+            order = np.argsort(-fused, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(distances, order, axis=1),
+                np.take_along_axis(ids, order, axis=1),
+                np.take_along_axis(fused, order, axis=1))
+
+    def search_vectors(self, query_vecs, k=None, filters=None, query_texts=None):
+        """Return ``(distances, faiss_ids)`` for a matrix of query embeddings.
+
+        Passing the ``query_texts`` the vectors came from enables the rerank
+        stage (CONFIG ``use_rerank``), which fuses dense and lexical scores.
+        """
+        distances, ids, _ = self._search(query_vecs, k, filters, query_texts)
+        return distances, ids
+
+    def retrieve_batch(self, queries, k=None, filters=None):
+        """Retrieve for many queries at once: packed embedding calls, one matrix search.
+
+        Returns one list of RetrievalHit per query, ordered by rank.
+        """
+        if len(queries) == 0:
+            return []
+        queries = list(queries)
+        distances, ids, scores = self._search(self.embed(queries), k, filters, queries)
+        if scores is None:
+            scores = np.full(ids.shape, np.nan)
+        loader = _OfferLoader(self, np.unique(ids[ids >= 0]).tolist())
+        return [
+            [
+                RetrievalHit(int(i), float(d), rank, loader, None if np.isnan(f) else float(f))
+                for rank, (d, i, f) in enumerate(zip(row_d, row_i, row_f)) if i >= 0
+            ]
+            for row_d, row_i, row_f in zip(distances, ids, scores)
+        ]
+
+    def search(self, query_text, k=None, filters=None):
+        """Return the top job offers for ``query_text`` as formatted strings."""
+        return [hit.text for hit in self.retrieve_batch([query_text], k, filters)[0]]
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    """Process-wide Retriever, created on first use."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = Retriever()
+    return _retriever
+
+
+def retrieve_similar_offers(query_text, filters=None):
+    """Return the top job offers for ``query_text`` as formatted strings.
+
+    ``filters`` restricts the search to matching postings, e.g.
+    ``{"country": "Canada", "remote_type": "Remote", "salary_min": (90000, None)}``.
+    """
+    return get_retriever().search(query_text, filters=filters)
+
+
+def retrieve_batch(queries, k=None, filters=None):
+    """Structured results for many queries; see Retriever.retrieve_batch."""
+    return get_retriever().retrieve_batch(queries, k, filters)
@@ -0,0 +1,226 @@
+# server.py
+"""Asyncio HTTP retrieval service with dynamic micro-batching.
+
+Concurrent ``POST /search`` requests arriving within ``batch_max_wait_ms`` of
+each other (up to ``batch_max_size``) are embedded together and searched as
+one query matrix, then answered individually. ``GET /health`` reports index
+size, batching and latency percentiles; ``GET /metrics`` serves the tracing
+counters and histograms in the Prometheus text format.
+
+    python main.py --serve --port 8000
+    curl -X POST localhost:8000/search -d '{"query": "python engineer", "k": 5, "filters": {"country": "Canada"}}'
+"""
+import asyncio
+import json
+import time
+from collections import deque
+import numpy as np
+from config import CONFIG
+from retriever import get_retriever
+from tracing import span, observe, prometheus_text
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _hit_to_dict(hit):
+    return {
+        "job_id": hit.job_id,
+        "rank": hit.rank,
+        "distance": hit.distance,
+        "score": hit.score,
+        "title": hit.get("title_translated"),
+        "description": hit.get("description"),
+    }
+
+
+class MicroBatcher:
+    """Coalesces concurrent queries into batches for Retriever.retrieve_batch."""
+
+    def __init__(self, retriever, max_batch, max_wait_ms):
+        self.retriever = retriever
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.n_batches = 0
+        self.n_queries = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, query, k, filters):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, k, filters, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Queries only share a search when they share filters.
+            groups = {}
+            for item in batch:
+                groups.setdefault(json.dumps(item[2], sort_keys=True), []).append(item)
+            for items in groups.values():
+                # Run in a worker thread so the next batch can be collected meanwhile.
+                loop.run_in_executor(None, self._execute, loop, items)
+            self.n_batches += len(groups)
+            self.n_queries += len(batch)
+
+    def _execute(self, loop, items):
+        k = max(item[1] for item in items)
+        filters = items[0][2]
+        observe("server_batch_size", len(items))
+        try:
+            with span("server.batch", queries=len(items)):
+                results = self.retriever.retrieve_batch([item[0] for item in items], k, filters)
+                payloads = [[_hit_to_dict(hit) for hit in hits[: item[1]]] for item, hits in zip(items, results)]
+        except Exception as e:
+            for item in items:
+                loop.call_soon_threadsafe(_set_exception, item[3], e)
+            return
+        for item, payload in zip(items, payloads):
+            loop.call_soon_threadsafe(_set_result, item[3], payload)
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+def _parse_search(body):
+    """``(query, k, filters)`` of a /search body; raises ValueError on bad input.
+
+    Checked before the query joins a batch, so one bad request cannot fail the others.
+    """
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise ValueError("body is not valid JSON")
+    if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+        raise ValueError("expected a JSON body with a 'query' string")
+    k = request.get("k", CONFIG["retrieval_top_k"])
+    if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+        raise ValueError("'k' must be a positive integer")
+    filters = request.get("filters")
+    if filters is not None:
+        if not isinstance(filters, dict):
+            raise ValueError("'filters' must be an object")
+        for col, condition in filters.items():
+            kind = CONFIG["filter_columns"].get(col)
+            if kind is None:
+                raise ValueError(f"column {col!r} is not filterable; expected one of {sorted(CONFIG['filter_columns'])}")
+            if kind == "range" and not (isinstance(condition, list) and len(condition) == 2):
+                raise ValueError(f"filter on {col!r} must be a [low, high] pair")
+    return request["query"], k, filters
+
+
+class RetrievalServer:
+    def __init__(self, retriever=None, max_batch=None, max_wait_ms=None):
+        self.retriever = retriever or get_retriever()
+        self.batcher = MicroBatcher(
+            self.retriever,
+            max_batch or CONFIG["batch_max_size"],
+            max_wait_ms if max_wait_ms is not None else CONFIG["batch_max_wait_ms"],
+        )
+        self.latencies_ms = deque(maxlen=10000)
+        self.started = time.time()
+
+    def health(self):
+        latencies = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        batches = self.batcher.n_batches
+        return {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started, 1),
+            "index_size": len(self.retriever.job_index),
+            "requests": len(self.latencies_ms),
+            "batches": batches,
+            "mean_batch_size": self.batcher.n_queries / batches if batches else 0.0,
+            "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+            "query_cache": self.retriever.query_cache.stats(),
+        }
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, self.health()
+        if method == "GET" and path == "/metrics":
+            return 200, prometheus_text()
+        if method == "POST" and path == "/search":
+            try:
+                query, k, filters = _parse_search(body)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            start = time.perf_counter()
+            try:
+                hits = await self.batcher.submit(query, k, filters)
+            except ValueError as e:
+                # Raised by the retriever for input it rejects, e.g. a filter value of the wrong type.
+                return 400, {"error": str(e)}
+            self.latencies_ms.append((time.perf_counter() - start) * 1000)
+            observe("server_request_seconds", time.perf_counter() - start)
+            return 200, {"results": hits}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self._route(method, path.split("?", 1)[0], body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), PROMETHEUS_CONTENT_TYPE
+                else:
+                    data, content_type = json.dumps(payload, default=str).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"Retrieval service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(host=None, port=None):
+    asyncio.run(RetrievalServer().serve(host or CONFIG["server_host"], port or CONFIG["server_port"]))
@@ -2,6 +2,9 @@
 Node functions for the CV generation workflow.
 
 Each function represents a step in the LangGraph workflow for generating tailored CVs.
+Nodes return only the state keys they produce; LangGraph merges these updates
+through the reducers declared on CVGeneratorState, which is what lets the
+section nodes run in parallel.
 """
 
 from langchain_core.messages import AIMessage
@@ -11,12 +14,20 @@ from dotenv import load_dotenv
 import os
 import json
 
+try:
+    from tracing import traced
+except ImportError:
+    # The package can run without the retrieval modules on the path; nodes are then untraced.
+    def traced(name):
+        return lambda fn: fn
+
 # Load environment variables
 load_dotenv()
 default_model = os.getenv("DEFAULT_MODEL", "gpt-3.5-turbo")
 default_temperature = float(os.getenv("DEFAULT_TEMPERATURE", "0.1"))
 
 
+@traced("cv_generator.extract_requirements")
 def extract_job_requirements(state):
     """
     Extract key requirements from the job posting.
@@ -84,13 +95,13 @@ Extract the key requirements in JSON format.""")
             "role": job_data.get("role_k50", "")
         }
     
-    # Update state
-    state["extracted_requirements"] = requirements
-    state["messages"].append(AIMessage(content=f"Extracted requirements: {requirements}"))
-    
-    return state
+    return {
+        "extracted_requirements": requirements,
+        "messages": [AIMessage(content=f"Extracted requirements: {requirements}")]
+    }
 
 
+@traced("cv_generator.generate_experience")
 def generate_experience_section(state):
     """
     Generate relevant work experience section.
@@ -136,12 +147,13 @@ Generate realistic work experience that shows progression and relevant achieveme
     response = llm.invoke(formatted_prompt)
     
     # Store the experience section
-    state["cv_sections"]["experience"] = response.content
-    state["messages"].append(AIMessage(content=f"Generated experience section"))
-    
-    return state
+    return {
+        "cv_sections": {"experience": response.content},
+        "messages": [AIMessage(content=f"Generated experience section")]
+    }
 
 
+@traced("cv_generator.generate_skills")
 def generate_skills_section(state):
     """
     Generate skills section highlighting relevant capabilities.
@@ -199,12 +211,13 @@ Generate a comprehensive skills section that matches these requirements. If the
     
     response = llm.invoke(formatted_prompt)
     
-    state["cv_sections"]["skills"] = response.content
-    state["messages"].append(AIMessage(content=f"Generated skills section"))
-    
-    return state
+    return {
+        "cv_sections": {"skills": response.content},
+        "messages": [AIMessage(content=f"Generated skills section")]
+    }
 
 
+@traced("cv_generator.generate_education")
 def generate_education_section(state):
     """
     Generate education section.
@@ -249,12 +262,13 @@ Generate realistic education background that supports the candidate's qualificat
     
     response = llm.invoke(formatted_prompt)
     
-    state["cv_sections"]["education"] = response.content
-    state["messages"].append(AIMessage(content=f"Generated education section"))
-    
-    return state
+    return {
+        "cv_sections": {"education": response.content},
+        "messages": [AIMessage(content=f"Generated education section")]
+    }
 
 
+@traced("cv_generator.compile_cv")
 def compile_final_cv(state):
     """
     Compile all sections into the final CV.
@@ -304,7 +318,7 @@ Format this into a professional, well-structured CV.""")
     
     response = llm.invoke(formatted_prompt)
     
-    state["final_cv"] = response.content
-    state["messages"].append(AIMessage(content=f"Compiled final CV"))
-    
-    return state
+    return {
+        "final_cv": response.content,
+        "messages": [AIMessage(content=f"Compiled final CV")]
+    }
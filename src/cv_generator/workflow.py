@@ -8,6 +8,14 @@ from langchain_core.messages import HumanMessage, AIMessage
 from typing import TypedDict, Annotated, List
 
 
+def merge_sections(left: dict, right: dict) -> dict:
+    """
+    Reducer for cv_sections: the section nodes run in parallel and each
+    returns only its own section, so their updates are merged key by key.
+    """
+    return {**(left or {}), **(right or {})}
+
+
 class CVGeneratorState(TypedDict):
     """
     State definition for the CV generation workflow.
@@ -25,7 +33,7 @@ class CVGeneratorState(TypedDict):
     
     # Processing steps
     extracted_requirements: dict  # Key skills, qualifications, and requirements
-    cv_sections: dict  # Different sections of the CV (experience, skills, etc.)
+    cv_sections: Annotated[dict, merge_sections]  # Different sections of the CV (experience, skills, etc.)
     
     # Output
     final_cv: str  # The complete generated CV
@@ -45,6 +53,9 @@ def create_cv_generator_graph():
     4. Generate Education Section - Add relevant education
     5. Compile Final CV - Combine all sections into final CV
     
+    Steps 2-4 only read the job data and extracted requirements, so they run
+    in parallel after step 1; step 5 waits for all three.
+    
     Returns:
         StateGraph: The configured LangGraph workflow
     """
@@ -71,10 +82,10 @@ def create_cv_generator_graph():
     # Define the workflow edges (execution order)
     workflow.set_entry_point("extract_requirements")
     
-    workflow.add_edge("extract_requirements", "generate_experience")
-    workflow.add_edge("generate_experience", "generate_skills")
-    workflow.add_edge("generate_skills", "generate_education")
-    workflow.add_edge("generate_education", "compile_cv")
+    sections = ["generate_experience", "generate_skills", "generate_education"]
+    for section in sections:
+        workflow.add_edge("extract_requirements", section)
+    workflow.add_edge(sections, "compile_cv")
     workflow.add_edge("compile_cv", END)
     
     return workflow.compile()
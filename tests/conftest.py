@@ -0,0 +1,27 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+import pytest
+
+# The modules live at the repository root rather than in a package.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_embeddings_server import start_in_thread  # noqa: E402
+
+
+@pytest.fixture
+def embeddings_server():
+    """``(base_url, stats)`` of a fake embeddings endpoint answering 64-dim vectors."""
+    server, url = start_in_thread(dim=64)
+    yield url, server.RequestHandlerClass.stats
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def flaky_embeddings_server():
+    """Like ``embeddings_server``, but a third of the requests get a 429 with ``retry-after``."""
+    server, url = start_in_thread(dim=64, rate_limit_prob=0.33)
+    yield url, server.RequestHandlerClass.stats
+    server.shutdown()
+    server.server_close()
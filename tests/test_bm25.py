@@ -0,0 +1,55 @@
+# tests/test_bm25.py
+import numpy as np
+import pytest
+from bm25 import BM25Index
+
+
+def zipf_corpus(n_docs, vocab_size, seed):
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"term{i}" for i in range(vocab_size)])
+    # Zipf-like term frequencies, as in real postings: a few long lists, a long tail of short ones.
+    p = 1.0 / np.arange(1, vocab_size + 1)
+    p /= p.sum()
+    docs = [" ".join(rng.choice(vocab, size=rng.integers(5, 80), p=p)) for _ in range(n_docs)]
+    queries = [" ".join(rng.choice(vocab, size=rng.integers(1, 9), p=p)) for _ in range(200)]
+    return docs, queries
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    docs, queries = zipf_corpus(3000, 2000, seed=7)
+    return BM25Index.fit(np.arange(len(docs)), docs, k1=1.2, b=0.75), queries
+
+
+def brute_force(index, text):
+    query = index.vectorizer.transform([text]).astype("float32")
+    return np.asarray((index.postings @ query.T).todense()).ravel()
+
+
+@pytest.mark.parametrize("k", [1, 5, 10, 50])
+def test_maxscore_matches_brute_force(corpus, k):
+    index, queries = corpus
+    for text in queries:
+        scores, rows = index.search(text, k)
+        expected = brute_force(index, text)
+        top = np.sort(expected)[::-1][:k]
+        top = top[top > 0]
+        # Ties at the k-th score may be broken either way, so compare scores, then each hit's own score.
+        np.testing.assert_allclose(scores[: len(top)], top, rtol=1e-5)
+        np.testing.assert_allclose(expected[rows[: len(top)]], scores[: len(top)], rtol=1e-5)
+
+
+def test_pruning_skips_postings(corpus):
+    index, queries = corpus
+    index.postings_scored = index.postings_total = 0
+    for text in queries:
+        index.search(text, 10)
+    stats = index.pruning_stats()
+    assert 0 < stats["postings_scored"] < stats["postings_total"]
+
+
+def test_search_batch_pads_missing_hits(corpus):
+    index, _ = corpus
+    scores, ids = index.search_batch(["term0 term1", "unknownword"], 5)
+    assert ids.shape == (2, 5) and (ids[0] >= 0).all()
+    assert (ids[1] == -1).all() and (scores[1] == 0).all()
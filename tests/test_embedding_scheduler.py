@@ -0,0 +1,85 @@
+# tests/test_embedding_scheduler.py
+import asyncio
+import random
+import numpy as np
+from openai import AsyncOpenAI
+from config import CONFIG
+from fake_embeddings_server import fake_embedding
+from embedding_scheduler import EmbeddingScheduler, embed_texts
+
+TEXTS = [f"job posting {i}: " + "python data engineer " * (i % 7 + 1) for i in range(300)]
+
+
+def expected(texts):
+    return np.stack([fake_embedding(t, 64) for t in texts])
+
+
+def embed(url, texts, checkpoint_dir=None, max_batch_items=16):
+    async def run():
+        client = AsyncOpenAI(api_key="test", base_url=url, max_retries=0)
+        scheduler = EmbeddingScheduler(client, "fake", max_concurrency=4, max_batch_items=max_batch_items, max_retries=20)
+        try:
+            return await scheduler.embed(texts, checkpoint_dir)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_rate_limited_batches_are_retried(flaky_embeddings_server):
+    url, stats = flaky_embeddings_server
+    random.seed(0)
+    vectors = embed(url, TEXTS)
+    assert stats["rate_limited"] > 0
+    assert stats["requests"] > len(TEXTS) // 16
+    np.testing.assert_allclose(vectors, expected(TEXTS), rtol=1e-6)
+
+
+def test_checkpoints_resume_without_requests(embeddings_server, tmp_path):
+    url, stats = embeddings_server
+    first = embed(url, TEXTS, tmp_path)
+    n_batches = stats["requests"]
+    assert len(list(tmp_path.glob("*.npy"))) == n_batches
+
+    second = embed(url, TEXTS, tmp_path)
+    assert stats["requests"] == n_batches
+    np.testing.assert_array_equal(first, second)
+
+
+def test_checkpoints_resume_a_partial_run(embeddings_server, tmp_path):
+    url, stats = embeddings_server
+    embed(url, TEXTS[:160], tmp_path)
+    before = stats["requests"]
+    # The first 10 batches of 16 are the same as in the interrupted run.
+    vectors = embed(url, TEXTS, tmp_path)
+    assert stats["requests"] - before == -(-(len(TEXTS) - 160) // 16)
+    np.testing.assert_allclose(vectors, expected(TEXTS), rtol=1e-6)
+
+
+def test_scheduler_is_shared_by_concurrent_calls(embeddings_server):
+    url, stats = embeddings_server
+
+    async def run():
+        client = AsyncOpenAI(api_key="test", base_url=url, max_retries=0)
+        scheduler = EmbeddingScheduler(client, "fake", max_concurrency=2, max_batch_items=8)
+        try:
+            return await asyncio.gather(scheduler.embed(TEXTS[:100]), scheduler.embed(TEXTS[100:]))
+        finally:
+            await client.close()
+
+    a, b = asyncio.run(run())
+    np.testing.assert_allclose(np.vstack([a, b]), expected(TEXTS), rtol=1e-6)
+
+
+def test_embed_texts_inside_a_running_loop(embeddings_server, tmp_path, monkeypatch):
+    url, _ = embeddings_server
+    key_path = tmp_path / "key.txt"
+    key_path.write_text("test")
+    monkeypatch.setitem(CONFIG, "openai_key_path", str(key_path))
+    monkeypatch.setitem(CONFIG, "embedding_base_url", url)
+
+    async def caller():
+        return embed_texts(TEXTS[:20], model="fake")
+
+    vectors = asyncio.run(caller())
+    np.testing.assert_allclose(vectors, expected(TEXTS[:20]), rtol=1e-6)
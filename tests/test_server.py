@@ -0,0 +1,144 @@
+# tests/test_server.py
+import asyncio
+import json
+import threading
+import numpy as np
+import pytest
+from config import CONFIG
+from embedding_provider import LocalEmbeddingProvider
+from retriever import RetrievalHit, _OfferLoader
+from server import MicroBatcher, RetrievalServer, _parse_search
+
+TITLES = ["python engineer", "data scientist", "nurse", "truck driver", "accountant", "react developer"]
+
+
+class _Store:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def get_many(self, faiss_ids, columns):
+        return {c: [self.columns[c][i] for i in faiss_ids] for c in columns}
+
+
+class RecordingRetriever:
+    """Exact search over a few offers embedded with the local provider; records every call."""
+
+    def __init__(self):
+        self.embedder = LocalEmbeddingProvider(dim=64)
+        self.vectors = self.embedder.embed(TITLES)
+        self.store = _Store({
+            "job_id": [f"job-{i}" for i in range(len(TITLES))],
+            "title_translated": TITLES,
+            "description": [f"We hire a {t}." for t in TITLES],
+            "country": ["Canada", "France"] * (len(TITLES) // 2),
+        })
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def retrieve_batch(self, queries, k=None, filters=None):
+        with self._lock:
+            self.calls.append((list(queries), k, filters))
+        if filters and not isinstance(filters.get("country", ""), str):
+            raise ValueError("country must be a string")
+        allowed = np.arange(len(TITLES))
+        if filters:
+            allowed = np.array([i for i in allowed if self.store.columns["country"][i] == filters["country"]])
+        distances = ((self.embedder.embed(queries)[:, None, :] - self.vectors[allowed][None]) ** 2).sum(axis=2)
+        results = []
+        for row in distances:
+            order = np.argsort(row)[:k]
+            loader = _OfferLoader(self, allowed[order].tolist())
+            results.append([RetrievalHit(int(allowed[j]), float(row[j]), rank, loader) for rank, j in enumerate(order)])
+        return results
+
+
+def run_queries(batcher, requests):
+    async def run():
+        batcher.start()
+        return await asyncio.gather(*(batcher.submit(*r) for r in requests))
+
+    return asyncio.run(run())
+
+
+def test_concurrent_queries_share_one_batch():
+    retriever = RecordingRetriever()
+    batcher = MicroBatcher(retriever, max_batch=16, max_wait_ms=50)
+    results = run_queries(batcher, [("python", 1, None), ("nurse", 3, None), ("driver", 2, None)])
+
+    assert len(retriever.calls) == 1
+    queries, k, _ = retriever.calls[0]
+    assert sorted(queries) == ["driver", "nurse", "python"] and k == 3
+    # Each query still gets its own k.
+    assert [len(r) for r in results] == [1, 3, 2]
+    assert results[0][0]["title"] == "python engineer"
+    assert results[1][0]["job_id"] == "job-2"
+
+
+def test_batches_are_split_by_filters():
+    retriever = RecordingRetriever()
+    batcher = MicroBatcher(retriever, max_batch=16, max_wait_ms=50)
+    results = run_queries(batcher, [
+        ("engineer", 5, {"country": "Canada"}),
+        ("developer", 5, None),
+        ("scientist", 5, {"country": "Canada"}),
+    ])
+
+    assert batcher.n_batches == 2 and batcher.n_queries == 3
+    by_filters = {json.dumps(filters): sorted(queries) for queries, _, filters in retriever.calls}
+    assert by_filters == {'{"country": "Canada"}': ["engineer", "scientist"], "null": ["developer"]}
+    assert all(hit["job_id"] in ("job-0", "job-2", "job-4") for hit in results[0] + results[2])
+    assert len(results[1]) == 5
+
+
+def test_batch_size_is_bounded():
+    retriever = RecordingRetriever()
+    batcher = MicroBatcher(retriever, max_batch=4, max_wait_ms=50)
+    results = run_queries(batcher, [(t, 1, None) for t in TITLES * 2])
+
+    assert max(len(queries) for queries, _, _ in retriever.calls) <= 4
+    assert sum(len(queries) for queries, _, _ in retriever.calls) == 12
+    assert [r[0]["title"] for r in results] == TITLES * 2
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b"[1, 2]",
+    b'{"k": 3}',
+    b'{"query": 42}',
+    b'{"query": "x", "k": 0}',
+    b'{"query": "x", "k": "5"}',
+    b'{"query": "x", "k": true}',
+    b'{"query": "x", "filters": ["country"]}',
+    b'{"query": "x", "filters": {"not_a_column": 1}}',
+    b'{"query": "x", "filters": {"salary_min": 90000}}',
+    b'{"query": "x", "filters": {"salary_min": [1, 2, 3]}}',
+])
+def test_parse_search_rejects(body, monkeypatch):
+    monkeypatch.setitem(CONFIG, "filter_columns", {"country": "category", "salary_min": "range"})
+    with pytest.raises(ValueError):
+        _parse_search(body)
+
+
+def test_parse_search_defaults(monkeypatch):
+    monkeypatch.setitem(CONFIG, "filter_columns", {"country": "category", "salary_min": "range"})
+    assert _parse_search(b'{"query": "x"}') == ("x", CONFIG["retrieval_top_k"], None)
+    assert _parse_search(b'{"query": "x", "k": 2, "filters": {"salary_min": [1, null]}}') == (
+        "x", 2, {"salary_min": [1, None]})
+
+
+def test_bad_requests_get_400_and_do_not_fail_the_batch(monkeypatch):
+    monkeypatch.setitem(CONFIG, "filter_columns", {"country": "category"})
+    server = RetrievalServer(RecordingRetriever(), max_batch=16, max_wait_ms=50)
+
+    async def run():
+        server.batcher.start()
+        return await asyncio.gather(
+            server._route("POST", "/search", b'{"query": "nurse", "k": 1}'),
+            server._route("POST", "/search", b'{"query": "nurse", "k": -1}'),
+            server._route("POST", "/search", b'{"query": "nurse", "filters": {"country": 3}}'),
+        )
+
+    (ok, ok_body), (bad_k, _), (bad_filter, error) = asyncio.run(run())
+    assert (ok, bad_k, bad_filter) == (200, 400, 400)
+    assert ok_body["results"][0]["title"] == "nurse"
+    assert "country" in error["error"]
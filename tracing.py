@@ -0,0 +1,252 @@
+# tracing.py
+"""Stage tracing: nested timed spans, counters and histograms.
+
+Tracing is off unless CONFIG ``tracing`` is set or ``enable()`` is called;
+while off, ``span`` hands back a shared no-op context manager and ``count`` /
+``observe`` return at once, so instrumented hot paths cost one flag check.
+
+    with span("retriever.search", k=5):
+        ...
+    count("embedding_tokens_total", resp.usage.total_tokens)
+
+Spans are written as a Chrome trace-event JSON file (open it in Perfetto or
+chrome://tracing) by ``export_trace``; counters, histograms and per-stage
+durations are rendered in the Prometheus text format by ``prometheus_text``.
+"""
+import bisect
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from config import CONFIG
+
+# Seconds; also used for non-latency histograms, whose values are counts.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = bool(CONFIG.get("tracing"))
+_lock = threading.Lock()
+_origin = time.perf_counter()
+_spans = []
+_dropped = 0
+_counters = {}
+_histograms = {}
+_span_ids = itertools.count(1)
+# A contextvar rather than a thread-local, so spans nest correctly inside asyncio tasks too.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Drop every recorded span and metric."""
+    global _dropped
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _histograms.clear()
+        _dropped = 0
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "start", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+
+    def set(self, **attrs):
+        """Attach attributes discovered inside the span (sizes, hit counts...)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record_span(self, duration)
+        return False
+
+
+def span(name, **attrs):
+    """Time the enclosed block as a stage called ``name``, nested under the current span."""
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name):
+    """Decorator form of ``span`` for whole functions."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _record_span(s, duration):
+    global _dropped
+    _observe("stage_duration_seconds", duration, {"stage": s.name})
+    with _lock:
+        if len(_spans) >= CONFIG.get("trace_max_spans", 100000):
+            _dropped += 1
+            return
+        _spans.append((s.name, s.start - _origin, duration, threading.get_ident(), s.span_id, s.parent_id, s.attrs))
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add ``value`` to the counter ``name`` (tokens, bytes, cache hits...)."""
+    if not _enabled:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record ``value`` in the histogram ``name``."""
+    if not _enabled:
+        return
+    _observe(name, value, labels)
+
+
+def _observe(name, value, labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": [0] * (len(DEFAULT_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        hist["buckets"][bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+def export_trace(path=None):
+    """Write the recorded spans as Chrome trace events; returns the path written."""
+    path = Path(path or CONFIG["trace_path"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pid = os.getpid()
+    with _lock:
+        spans = list(_spans)
+        dropped = _dropped
+    events = [
+        {"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid,
+         "args": {"span_id": span_id, "parent_id": parent_id, **attrs}}
+        for name, start, duration, tid, span_id, parent_id, attrs in spans
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "otherData": {"dropped_spans": dropped}}, f, default=str)
+    return path
+
+
+def summary():
+    """Per-stage call count, total and mean seconds, slowest total first."""
+    with _lock:
+        stages = [(dict(key[1])["stage"], h["count"], h["sum"]) for key, h in _histograms.items()
+                  if key[0] == "stage_duration_seconds"]
+    return [{"stage": stage, "calls": n, "total_s": total, "mean_ms": total / n * 1000}
+            for stage, n, total in sorted(stages, key=lambda s: -s[2])]
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+def prometheus_text():
+    """Counters and histograms in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, {**h, "buckets": list(h["buckets"])}) for key, h in _histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), h in histograms:
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        cumulative = 0
+        for bound, n in zip(list(DEFAULT_BUCKETS) + ["+Inf"], h["buckets"]):
+            cumulative += n
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve ``prometheus_text`` on ``http://host:port/metrics`` from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,11 +1,35 @@
 # utils.py
 import os
+import random
 import faiss
 import numpy as np
+import openai
+import pyarrow.dataset as ds
+from tracing import span, count
+
+# OpenAI errors worth retrying with backoff, for embeddings and completions alike.
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
 
 def read_secret_key(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read().strip()
+    with span("secret.load"):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text with cl100k-style tokenizers.
+    return max(1, len(text) // 4)
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retry ``attempt``: the server's Retry-After, else jittered exponential backoff."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
 
 def load_texts(directory):
     texts = []
@@ -17,7 +41,32 @@ def load_texts(directory):
     return texts
 
 def save_faiss_index(index, path):
-    faiss.write_index(index, path)
+    # Write then rename, so processes that have the old file memory-mapped keep a valid view.
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
 
-def load_faiss_index(path):
+def load_faiss_index(path, mmap=False):
+    """Read an index; with ``mmap`` the vector codes stay in the page cache instead of private RAM.
+
+    Memory-mapped indexes are read-only: load without ``mmap`` to add or remove vectors.
+    """
+    if mmap:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
     return faiss.read_index(path)
+
+def iter_parquet_batches(path, columns, predicate=None, batch_rows=4096):
+    """Stream record batches of the requested columns, pushing ``predicate`` down to the scan."""
+    dataset = ds.dataset(path, format="parquet")
+    available = set(dataset.schema.names)
+    columns = [c for c in columns if c in available]
+    batches = dataset.to_batches(columns=columns, filter=predicate, batch_size=batch_rows)
+    while True:
+        # Timed around next() only: a span must not stay open across the yield.
+        with span("parquet.read_batch"):
+            batch = next(batches, None)
+        if batch is None:
+            return
+        count("parquet_bytes_read_total", batch.nbytes)
+        if batch.num_rows:
+            yield batch
@@ -0,0 +1,151 @@
+# vector_store.py
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+
+class MemmapVectorStore:
+    """Append-only float32 vectors on disk, addressed by string key.
+
+    Vectors live in a raw ``vectors.f32`` file read through ``np.memmap``;
+    ``keys.txt`` holds one key per line, so the line number is the row offset.
+    Deleted and overwritten rows stay in the files until ``compact`` rewrites
+    them as a new generation (``vectors.<n>.f32``, ``keys.<n>.txt``), which
+    ``meta.json`` then points to.
+    """
+
+    def __init__(self, directory, dim=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._meta_path = self.directory / "meta.json"
+        self._mmap = None
+        self.offsets = {}
+        self.dim = dim
+        self.generation = 0
+
+        if self._meta_path.exists():
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.generation = meta.get("generation", 0)
+        self._data_path, self._keys_path = self._paths(self.generation)
+        self._load_keys()
+        if self.n_rows:
+            # Mapped now, so the rows stay readable if a writer compacts the store later.
+            self._vectors()
+
+    def _paths(self, generation):
+        if generation == 0:
+            return self.directory / "vectors.f32", self.directory / "keys.txt"
+        return self.directory / f"vectors.{generation}.f32", self.directory / f"keys.{generation}.txt"
+
+    def _write_meta(self):
+        tmp = self._meta_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "generation": self.generation}, f)
+        os.replace(tmp, self._meta_path)
+
+    def _load_keys(self):
+        n_rows = 0
+        n_bytes = 0
+        if self._keys_path.exists():
+            with open(self._keys_path, "rb") as f:
+                for line in f:
+                    # A line without its newline was cut short by a crash.
+                    if not line.endswith(b"\n"):
+                        break
+                    self.offsets[line[:-1].decode("utf-8")] = n_rows
+                    n_rows += 1
+                    n_bytes += len(line)
+            if os.path.getsize(self._keys_path) != n_bytes:
+                with open(self._keys_path, "r+b") as f:
+                    f.truncate(n_bytes)
+        self.n_rows = n_rows
+
+        # Drop any rows written after the last complete key.
+        if self.dim and self._data_path.exists():
+            expected = n_rows * self.dim * 4
+            if os.path.getsize(self._data_path) != expected:
+                with open(self._data_path, "r+b") as f:
+                    f.truncate(expected)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def _vectors(self):
+        if self._mmap is None or self._mmap.shape[0] != self.n_rows:
+            self._mmap = np.memmap(self._data_path, dtype="float32", mode="r", shape=(self.n_rows, self.dim))
+        return self._mmap
+
+    def get_many(self, keys):
+        """Return ``(vectors, found)`` where ``found`` masks the keys present in the store."""
+        rows = np.array([self.offsets.get(k, -1) for k in keys], dtype="int64")
+        found = rows >= 0
+        if not found.any():
+            return np.empty((0, self.dim or 0), dtype="float32"), found
+        return np.array(self._vectors()[rows[found]]), found
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(keys) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if not self._meta_path.exists():
+            self._write_meta()
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dim {self.dim}, got {vectors.shape[1]}")
+
+        # Vectors first, keys second: a crash in between leaves orphan rows
+        # that are truncated on the next open.
+        with open(self._data_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._keys_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{k}\n" for k in keys))
+
+        for k in keys:
+            self.offsets[k] = self.n_rows
+            self.n_rows += 1
+
+    def delete_many(self, keys):
+        """Forget ``keys``; their rows are reclaimed by the next ``compact``."""
+        for k in keys:
+            self.offsets.pop(k, None)
+
+    def compact(self, chunk_rows=65536):
+        """Rewrite the live rows into a new generation and drop the old files.
+
+        Deletions are only persisted here: until then ``keys.txt`` still lists
+        the deleted keys.
+        """
+        if self.n_rows == len(self.offsets):
+            return
+        keys = list(self.offsets)
+        data_path, keys_path = self._paths(self.generation + 1)
+        with open(data_path, "wb") as f:
+            for start in range(0, len(keys), chunk_rows):
+                rows = [self.offsets[k] for k in keys[start:start + chunk_rows]]
+                f.write(np.ascontiguousarray(self._vectors()[rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(keys_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{k}\n" for k in keys))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # meta.json is the commit point: a crash before it leaves the old generation in use.
+        old_paths = (self._data_path, self._keys_path)
+        self.generation += 1
+        self._write_meta()
+        for path in old_paths:
+            path.unlink(missing_ok=True)
+        self._data_path, self._keys_path = data_path, keys_path
+        self.offsets = {k: i for i, k in enumerate(keys)}
+        self.n_rows = len(keys)
+        self._mmap = None